@@ -1,19 +1,84 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 
+import gzip
+import hashlib
+import json
+import logging
+import marshal
 import os
+import re
+import subprocess
 import sys
+import time
 
 from codecs import open as codecs_open
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import chain
+from math import ceil
+from operator import attrgetter
+from xml.sax.saxutils import escape
+
+from jinja2 import Environment, FileSystemLoader
 
 from pelican import signals
 
 from pytz import timezone
 
 if sys.version_info >= (3, 0):
-    from urllib.parse import urljoin
+    import pickle
+    from html.parser import HTMLParser
+    from urllib.parse import quote, urljoin, urlsplit, urlunsplit
 else:
-    from urlparse import urljoin
+    import cPickle as pickle
+    from HTMLParser import HTMLParser
+    from urllib import quote
+    from urlparse import urljoin, urlsplit, urlunsplit
+
+try:
+    from os import replace as replace_file
+except ImportError:
+    # Python 2, os.rename replaces existing files atomically on POSIX but fails on Windows
+    def replace_file(src, dst):
+        if os.name == 'nt' and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+try:
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+except ImportError:
+    # Python 2 without the futures backport, the sites of a batch are always generated serially
+    ProcessPoolExecutor = ThreadPoolExecutor = None
+
+
+logger = logging.getLogger(__name__)
+
+# renderers by their parameters, shared by all generators of the process
+_renderers = {}
+
+# jinja environments rendering the stylesheet by template search path and options, shared by all generators of the
+# process, so the stylesheet template is only loaded and compiled once
+_stylesheet_environments = {}
+
+# sent by the SitemapGenerator with the generator as sender and the list of SitemapEntry as "entries"
+sitemap_generated = signals.signal('extended_sitemap_generated')
+
+# characters allowed in an URI without percent-encoding (RFC 3986), "%" is kept as start of an existing escape
+_uri_safe_chars = "/:?#[]@!$&'()*+,;=%~"
+
+# matches a "%" that does not start an escape
+_re_bare_percent = re.compile(r'%(?![0-9A-Fa-f]{2})')
+
+# matches any character that has to be percent-encoded in an URI
+_re_uri_unsafe = re.compile(r"[^A-Za-z0-9\-._~:/?#\[\]@!$&'()*+,;=%]|%(?![0-9A-Fa-f]{2})")
+
+# the values of <changefreq> allowed by sitemaps.org
+_changefrequencies = ('always', 'hourly', 'daily', 'weekly', 'monthly', 'yearly', 'never')
+
+# matches numbered and named backreferences of a regex, which break if the regex is joined with others
+_re_backreference = re.compile(r'\\[1-9]|\(\?P=')
 
 
 class ConfigurationError(Exception):
@@ -23,13 +88,687 @@ class ConfigurationError(Exception):
     pass
 
 
+class SitemapStatistics(object):
+    """
+    Collects the timings of the generation phases, the number of emitted url nodes and the number of written bytes.
+    Timings are exclusive, time spent in a nested phase is not accounted to the enclosing phase. If not enabled,
+    nothing is measured.
+    """
+
+    timer = getattr(time, 'perf_counter', time.time)
+
+    def __init__(self, enabled=True):
+        """
+        :param enabled: whether to collect the statistics
+        :type enabled: bool
+        """
+        self.enabled = enabled
+        self.timings = OrderedDict()
+        self.nodes = OrderedDict()
+        self.bytes_written = 0
+        # the currently running phases as [name, start time] lists
+        self.stack = []
+
+    def start(self, phase):
+        """
+        Starts the given phase and pauses the currently running phase.
+        :param phase: name of the phase
+        :type phase: str
+        """
+        now = self.timer()
+        if self.stack:
+            self.__account(self.stack[-1][0], now - self.stack[-1][1])
+        self.stack.append([phase, now])
+
+    def stop(self):
+        """
+        Stops the currently running phase and resumes the enclosing phase.
+        """
+        now = self.timer()
+        phase, started = self.stack.pop()
+        self.__account(phase, now - started)
+        if self.stack:
+            self.stack[-1][1] = now
+
+    @contextmanager
+    def measure(self, phase):
+        """
+        Context manager measuring the enclosed block as the given phase.
+        :param phase: name of the phase
+        :type phase: str
+        """
+        if not self.enabled:
+            yield
+            return
+        self.start(phase)
+        try:
+            yield
+        finally:
+            self.stop()
+
+    def measure_nodes(self, phase, nodes, count=True):
+        """
+        Wraps the given url node generator, measuring the time spent in it as the given phase and counting its nodes.
+        :param phase: name of the phase
+        :type phase: str
+        :param nodes: iterable of url nodes
+        :type nodes: collections.Iterable
+        :param count: whether to count the nodes for the given phase
+        :type count: bool
+        :returns: iterable of the same url nodes
+        :rtype: collections.Iterable
+        """
+        if not self.enabled:
+            return nodes
+        return self.__measure_nodes(phase, iter(nodes), count)
+
+    def __measure_nodes(self, phase, iterator, count):
+        if count:
+            self.nodes.setdefault(phase, 0)
+        while True:
+            self.start(phase)
+            try:
+                node = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.stop()
+            if count:
+                self.nodes[phase] += 1
+            yield node
+
+    def add_bytes_written(self, count):
+        """
+        Adds the given number of bytes to the written bytes.
+        :param count: number of bytes
+        :type count: int
+        """
+        self.bytes_written += count
+
+    def as_dict(self):
+        """
+        Returns the statistics as dictionary that can be serialized as JSON.
+        :rtype: dict
+        """
+        return OrderedDict([
+            ('timings', OrderedDict((phase, round(duration, 6)) for phase, duration in self.timings.items())),
+            ('total_time', round(sum(self.timings.values()), 6)),
+            ('nodes', self.nodes),
+            ('total_nodes', sum(self.nodes.values())),
+            ('bytes_written', self.bytes_written),
+        ])
+
+    def __account(self, phase, duration):
+        self.timings[phase] = self.timings.get(phase, 0.0) + duration
+
+
+class DigestWriter(object):
+    """
+    Writable wrapper of a binary file computing the digest of the written bytes.
+    """
+
+    def __init__(self, fd):
+        """
+        :param fd: the binary file to write into
+        :type fd: file
+        """
+        self.fd = fd
+        self.digest = hashlib.sha1()
+        self.size = 0
+
+    def write(self, data):
+        self.digest.update(data)
+        self.size += len(data)
+        return self.fd.write(data)
+
+    def flush(self):
+        self.fd.flush()
+
+    def close(self):
+        self.fd.close()
+
+
+class SitemapFile(object):
+    """
+    Writable text file for the sitemap output.
+    The text is encoded once and written into a plain and/or a gzip compressed temporary file. On close, the digest of
+    the written bytes is compared with the existing file, the temporary file atomically replaces the final file only if
+    the content changed. Unchanged files keep their bytes and modification time and the final files are never seen
+    half written.
+    """
+
+    def __init__(self, path, plain=True, compresslevel=None, statistics=None):
+        """
+        Opens the temporary files.
+        :param path: the path of the plain file, the compressed file gets the additional suffix ".gz"
+        :type path: str
+        :param plain: whether to write the plain file
+        :type plain: bool
+        :param compresslevel: the gzip compression level, no compressed file is written if None
+        :type compresslevel: int | None
+        :param statistics: the statistics to add the number of written bytes to on close
+        :type statistics: SitemapStatistics | None
+        """
+        self.statistics = statistics
+        # tuples of final path, digest writer of the temporary file and the stream to write into
+        self.files = []
+        # number of uncompressed bytes written
+        self.bytes_written = 0
+        if plain:
+            fd = DigestWriter(open(path + '.tmp', 'wb'))
+            self.files.append((path, fd, fd))
+        if compresslevel is not None:
+            path_gz = path + '.gz'
+            fd = DigestWriter(open(path_gz + '.tmp', 'wb'))
+            # a fixed file name and no mtime in the gzip header, so the same content always results in the same bytes
+            stream = gzip.GzipFile(
+                filename=os.path.basename(path_gz),
+                mode='wb',
+                compresslevel=compresslevel,
+                fileobj=fd,
+                mtime=0
+            )
+            self.files.append((path_gz, fd, stream))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def write(self, text):
+        """
+        Writes the given text into all files.
+        :param text: the text to write
+        :type text: str
+        """
+        data = text.encode('utf-8')
+        self.bytes_written += len(data)
+        for path, fd, stream in self.files:
+            stream.write(data)
+
+    def close(self):
+        """
+        Closes the temporary files and moves them to their final location if their content changed.
+        """
+        for path, fd, stream in self.files:
+            if stream is not fd:
+                stream.close()
+            fd.close()
+            self.__commit(path + '.tmp', path, fd)
+        self.files = []
+        if self.statistics is not None:
+            self.statistics.add_bytes_written(self.bytes_written)
+
+    def discard(self):
+        """
+        Closes and removes the temporary files, the final files are kept as they are.
+        """
+        for path, fd, stream in self.files:
+            if stream is not fd:
+                stream.close()
+            fd.close()
+            os.remove(path + '.tmp')
+        self.files = []
+
+    @staticmethod
+    def __commit(path_temp, path, fd):
+        """
+        Moves the temporary file to its final location if its content differs from the existing file.
+        :param path_temp: path of the newly written file
+        :type path_temp: str
+        :param path: path of the final file
+        :type path: str
+        :param fd: the writer of the temporary file
+        :type fd: DigestWriter
+        """
+        if os.path.exists(path) and os.path.getsize(path) == fd.size and get_file_digest(path) == fd.digest.digest():
+            os.remove(path_temp)
+        else:
+            replace_file(path_temp, path)
+
+
+class SitemapEntry(object):
+    """
+    A url of the sitemap, as exposed to other plugins.
+    """
+    __slots__ = ('loc', 'lastmod', 'changefreq', 'priority', 'type')
+
+    def __init__(self, loc, lastmod, changefreq, priority, type):
+        """
+        :param loc: the absolute url
+        :type loc: str
+        :param lastmod: the formatted modification date as written into the sitemap
+        :type lastmod: str | None
+        :param changefreq: the change frequency
+        :type changefreq: str
+        :param priority: the priority
+        :type priority: float
+        :param type: the content type of the url, one of the keys of the priorities setting
+        :type type: str
+        """
+        self.loc = loc
+        self.lastmod = lastmod
+        self.changefreq = changefreq
+        self.priority = priority
+        self.type = type
+
+    def __repr__(self):
+        return 'SitemapEntry({!r}, {!r}, {!r}, {!r}, {!r})'.format(
+            self.loc, self.lastmod, self.changefreq, self.priority, self.type
+        )
+
+
+class SitemapMediaParser(HTMLParser):
+    """
+    Extracts the sources of the images and videos of rendered content.
+    """
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.images = []
+        # dicts with the src, poster and title attributes of the videos
+        self.videos = []
+        self.video = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'img':
+            if attrs.get('src'):
+                self.images.append(attrs['src'])
+        elif tag == 'video':
+            self.video = {'src': attrs.get('src'), 'poster': attrs.get('poster'), 'title': attrs.get('title')}
+            self.videos.append(self.video)
+        elif tag == 'source' and self.video is not None and not self.video['src']:
+            self.video['src'] = attrs.get('src')
+
+    def handle_endtag(self, tag):
+        if tag == 'video':
+            self.video = None
+
+
+class SitemapRenderer(object):
+    """
+    Renders the <url> nodes of the sitemap.
+    The constant parts of the nodes are compiled once per content type, the dates are formatted in the configured
+    timezone from memoized calendar day and utc offset strings and simple relative urls are joined with the site url
+    without a full url parse. Urls that are already valid URIs without xml special characters, which are nearly all of
+    them, are neither encoded nor escaped.
+    """
+
+    # urls that urljoin would not simply append to the site url
+    re_complex_url = re.compile(r'^/|[?#:\s\\]|//|(?:^|/)\.\.?(?:/|$)')
+
+    # the formatted dates by ordinal and the formatted utc offsets by offset, shared by all renderers of the process
+    dates = {}
+    offsets = {}
+
+    def __init__(self, url_site, template_url, changefrequencies, priorities, timezone=None, lastmod_precision='date'):
+        """
+        Compiles the node fragments.
+        :param url_site: the site url ending with a slash
+        :type url_site: str
+        :param template_url: the template of the <url> node with a {} placeholder for its content
+        :type template_url: str
+        :param changefrequencies: the change frequency per content type
+        :type changefrequencies: dict
+        :param priorities: the priority per content type
+        :type priorities: dict
+        :param timezone: the timezone the lastmod values are normalized to, they are formatted as they are if None
+        :type timezone: pytz.tzinfo.BaseTzInfo | None
+        :param lastmod_precision: "date" for lastmod values like 2014-06-01, "datetime" for 2014-06-01T12:00:00+02:00
+        :type lastmod_precision: str
+        """
+        self.timezone = timezone
+        self.zone = get_zone_name(timezone)
+        self.lastmod_precision = lastmod_precision
+        self.url_site = url_site
+        # the fast url join is only safe if urljoin does not alter the site url itself
+        self.url_site_simple = urljoin(url_site, 'a') == url_site + 'a'
+        self.prefix, self.suffix = template_url.split('{}')
+        self.prefix += '<loc>'
+        # the fragments after the lastmod value per content type, with and without the closing part of the node
+        self.suffixes = {}
+        self.suffixes_open = {}
+        for content_type in set(changefrequencies) & set(priorities):
+            self.add_suffix(content_type, changefrequencies[content_type], priorities[content_type])
+
+    @classmethod
+    def get(cls, url_site, template_url, changefrequencies, priorities, timezone=None, lastmod_precision='date'):
+        """
+        Returns the renderer for the given parameters, it is only created and compiled once per process.
+        The parameters are the ones of the constructor.
+        :rtype: SitemapRenderer
+        """
+        key = (
+            url_site,
+            template_url,
+            tuple(sorted(changefrequencies.items())),
+            tuple(sorted(priorities.items())),
+            get_zone_name(timezone),
+            lastmod_precision,
+        )
+        renderer = _renderers.get(key)
+        if renderer is None:
+            renderer = _renderers[key] = cls(
+                url_site, template_url, changefrequencies, priorities, timezone, lastmod_precision
+            )
+        return renderer
+
+    def add_suffix(self, content_type, changefrequency, priority):
+        """
+        Compiles the node fragments after the lastmod value for the given content type.
+        :param content_type: the content type or a (content type, change frequency, priority) tuple of a rule override
+        :type content_type: str | tuple
+        :param changefrequency: the change frequency
+        :type changefrequency: str
+        :param priority: the priority
+        :type priority: float
+        """
+        self.suffixes_open[content_type] = '\n<changefreq>{}</changefreq>\n<priority>{:.2f}</priority>'.format(
+            changefrequency,
+            priority
+        )
+        self.suffixes[content_type] = self.suffixes_open[content_type] + self.suffix
+
+    def join_url(self, url):
+        """
+        Returns the absolute url for the given url relative to the site url, percent-encoded as URI.
+        :param url: the relative url
+        :type url: str
+        :rtype: str
+        """
+        if self.url_site_simple and url and self.re_complex_url.search(url) is None:
+            # a plain relative path, only the path itself may need to be percent-encoded
+            if _re_uri_unsafe.search(url) is None:
+                return self.url_site + url
+            return self.url_site + quote_uri(url)
+        return iri_to_uri(urljoin(self.url_site, url))
+
+    def format_date(self, date):
+        """
+        Returns the lastmod value for the given date in the configured timezone.
+        Only dates of other timezones are converted, naive dates are assumed to be in the configured timezone.
+        :param date: the date to format
+        :type date: datetime.datetime
+        :rtype: str
+        """
+        if self.timezone is not None:
+            if date.tzinfo is None:
+                date = self.timezone.localize(date)
+            elif get_zone_name(date.tzinfo) != self.zone:
+                date = date.astimezone(self.timezone)
+        day = date.toordinal()
+        formatted = self.dates.get(day)
+        if formatted is None:
+            formatted = self.dates[day] = date.strftime('%Y-%m-%d')
+        if self.lastmod_precision != 'datetime':
+            return formatted
+        offset = date.utcoffset()
+        formatted_offset = self.offsets.get(offset)
+        if formatted_offset is None:
+            formatted_offset = self.offsets[offset] = format_utc_offset(offset)
+        return '{}T{:02d}:{:02d}:{:02d}{}'.format(formatted, date.hour, date.minute, date.second, formatted_offset)
+
+    def render(self, loc, lastmod, content_type, extra=None):
+        """
+        Renders the <url> node text.
+        :param loc: the absolute url, percent-encoded but not xml escaped
+        :type loc: str
+        :param lastmod: the formatted modification date
+        :type lastmod: str | None
+        :param content_type: the type of the content to match settings.EXTENDED_SITEMAP_PLUGIN or a
+            (content type, change frequency, priority) tuple of a rule override
+        :type content_type: str | tuple
+        :param extra: additional child nodes of extensions like hreflang alternates
+        :type extra: str | None
+        :returns: the text node
+        :rtype: str
+        :raises ConfigurationError: if there is no priority or change frequency for the content type
+        """
+        if content_type not in self.suffixes:
+            if not isinstance(content_type, tuple):
+                raise ConfigurationError(
+                    'There is no priority or change frequency for the content type "{}"!'.format(content_type)
+                )
+            # rule overrides are compiled on first use
+            self.add_suffix(content_type, content_type[1], content_type[2])
+        if extra:
+            suffix = self.suffixes_open[content_type] + extra + self.suffix
+        else:
+            suffix = self.suffixes[content_type]
+        if '&' in loc or '<' in loc:
+            loc = escape(loc)
+        if lastmod is None:
+            return self.prefix + loc + '</loc>' + suffix
+        return self.prefix + loc + '</loc>\n<lastmod>' + lastmod + '</lastmod>' + suffix
+
+    @staticmethod
+    def render_image(loc):
+        """
+        Renders the <image:image> node of an image.
+        :param loc: the absolute url of the image
+        :type loc: str
+        :rtype: str
+        """
+        return '\n<image:image>\n<image:loc>{}</image:loc>\n</image:image>'.format(escape(loc))
+
+    @staticmethod
+    def render_video(thumbnail_loc, title, description, content_loc):
+        """
+        Renders the <video:video> node of a video.
+        :param thumbnail_loc: the absolute url of the thumbnail
+        :type thumbnail_loc: str
+        :param title: the title of the video
+        :type title: str
+        :param description: the description of the video
+        :type description: str
+        :param content_loc: the absolute url of the video file
+        :type content_loc: str
+        :rtype: str
+        """
+        return (
+            '\n<video:video>'
+            '\n<video:thumbnail_loc>{}</video:thumbnail_loc>'
+            '\n<video:title>{}</video:title>'
+            '\n<video:description>{}</video:description>'
+            '\n<video:content_loc>{}</video:content_loc>'
+            '\n</video:video>'
+        ).format(escape(thumbnail_loc), escape(title), escape(description), escape(content_loc))
+
+    @staticmethod
+    def render_alternate(lang, href):
+        """
+        Renders the <xhtml:link> node of a language alternate.
+        :param lang: the pelican language code of the alternate
+        :type lang: str
+        :param href: the absolute url of the alternate
+        :type href: str
+        :rtype: str
+        """
+        # hreflang expects BCP 47 codes like "pt-BR" instead of "pt_BR"
+        return '\n<xhtml:link rel="alternate" hreflang="{}" href="{}"/>'.format(
+            lang.replace('_', '-'),
+            escape(href, {'"': '&quot;'})
+        )
+
+
+class SitemapRules(object):
+    """
+    Priority, change frequency and exclusion rules for urls.
+    All url patterns are compiled once into a single alternation regex, so matching a url costs one regex match
+    regardless of the number of rules. Regexes with global flags, named groups or backreferences cannot be joined, if
+    there is one the patterns are matched one after another instead. The first matching rule in the order of the
+    configuration wins.
+    """
+
+    def __init__(self, rules):
+        """
+        Compiles the rules.
+        :param rules: the rules, dicts with exactly one of the conditions "pattern" (glob), "regex" or "category" and
+            the "priority", "changefreq" and/or "exclude" values to apply
+        :type rules: list
+        :raises ConfigurationError: if a rule is invalid
+        """
+        # copies with the priorities converted to floats
+        self.rules = [dict(rule) for rule in rules]
+        self.hits = [0] * len(rules)
+        # first rule index per category name
+        self.categories = {}
+        patterns = []
+        # (rule index, compiled regex) tuples of the url patterns, only matched one by one if they cannot be joined
+        self.matchers = []
+        joinable = True
+        # rule index by the number of the empty marker group closing its alternative
+        self.groups = {}
+        count_groups = 0
+        for index, rule in enumerate(self.rules):
+            conditions = [key for key in ('pattern', 'regex', 'category') if key in rule]
+            if len(conditions) != 1:
+                raise ConfigurationError(
+                    'Sitemap rule {} needs exactly one of "pattern", "regex" or "category"!'.format(index)
+                )
+            if not any(key in rule for key in ('priority', 'changefreq', 'exclude')):
+                raise ConfigurationError(
+                    'Sitemap rule {} needs at least one of "priority", "changefreq" or "exclude"!'.format(index)
+                )
+            if 'priority' in rule:
+                rule['priority'] = parse_priority(rule['priority'])
+                if rule['priority'] is None:
+                    raise ConfigurationError(
+                        'Sitemap rule {} needs a "priority" between 0.0 and 1.0!'.format(index)
+                    )
+            if 'changefreq' in rule and rule['changefreq'] not in _changefrequencies:
+                raise ConfigurationError(
+                    'Sitemap rule {} needs a "changefreq" of {}!'.format(index, ', '.join(_changefrequencies))
+                )
+            if 'category' in rule:
+                self.categories.setdefault(rule['category'], index)
+            else:
+                regex = self.translate_glob(rule['pattern']) if 'pattern' in rule else rule['regex']
+                try:
+                    compiled = re.compile(regex)
+                except re.error as e:
+                    raise ConfigurationError('Sitemap rule {} has an invalid regex: {}'.format(index, e))
+                if compiled.groupindex or compiled.flags & ~re.UNICODE or _re_backreference.search(regex):
+                    joinable = False
+                self.matchers.append((index, compiled))
+                count_groups += compiled.groups + 1
+                # a group around the pattern itself would prevent the literal prefix optimization of the regex engine,
+                # the rule is identified by the empty group at the end of its alternative instead
+                patterns.append('(?:{})()'.format(regex))
+                self.groups[count_groups] = index
+        # the alternatives are tried in order at the start of the url, so the first matching rule wins
+        self.matcher = None
+        if patterns and joinable:
+            try:
+                self.matcher = re.compile('|'.join(patterns))
+            except re.error:
+                pass
+        if self.matcher is not None:
+            self.matchers = []
+
+    @staticmethod
+    def translate_glob(pattern):
+        """
+        Translates the given glob pattern into a regex matching the whole url.
+        "*" matches any number of characters including slashes, "?" matches a single character.
+        :param pattern: the glob pattern
+        :type pattern: str
+        :rtype: str
+        """
+        return ''.join(
+            '.*' if char == '*' else '.' if char == '?' else re.escape(char) for char in pattern
+        ) + '$'
+
+    def match(self, url, category=None):
+        """
+        Returns the first rule matching the given url or category and counts the hit.
+        :param url: the url relative to the site url
+        :type url: str
+        :param category: the name of the category of the content
+        :type category: str | None
+        :returns: the rule or None if no rule matches
+        :rtype: dict | None
+        """
+        index = None
+        if self.matcher is not None:
+            match = self.matcher.match(url)
+            if match is not None:
+                index = self.groups[match.lastindex]
+        else:
+            for index_matcher, matcher in self.matchers:
+                if matcher.match(url) is not None:
+                    index = index_matcher
+                    break
+        if category is not None:
+            index_category = self.categories.get(category)
+            if index_category is not None and (index is None or index_category < index):
+                index = index_category
+        if index is None:
+            return None
+        self.hits[index] += 1
+        return self.rules[index]
+
+
+class SitemapValidator(object):
+    """
+    Detects duplicate urls, urls outside of the site url and urls longer than sitemaps.org allows.
+    Only the hashes of the seen urls are kept instead of the urls themselves. A hash collision would only result in a
+    false duplicate warning, which is very unlikely.
+    """
+
+    # maximum length of a url allowed by sitemaps.org
+    max_length = 2048
+
+    def __init__(self, url_site):
+        """
+        :param url_site: the site url ending with a slash
+        :type url_site: str
+        """
+        self.url_site = url_site
+        self.seen = set()
+        self.duplicates = 0
+        self.external = 0
+        self.too_long = 0
+
+    def validate(self, loc):
+        """
+        Checks the given url and logs a warning for every problem found.
+        :param loc: the absolute url
+        :type loc: str
+        :returns: whether the url is valid
+        :rtype: bool
+        """
+        valid = True
+        key = hash(loc)
+        if key in self.seen:
+            self.duplicates += 1
+            logger.warning('extended_sitemap: duplicate url %s', loc)
+            valid = False
+        else:
+            self.seen.add(key)
+        if not loc.startswith(self.url_site):
+            self.external += 1
+            logger.warning('extended_sitemap: url %s is outside of the site url %s', loc, self.url_site)
+            valid = False
+        if len(loc) > self.max_length:
+            self.too_long += 1
+            logger.warning('extended_sitemap: url %s is longer than %d characters', loc, self.max_length)
+            valid = False
+        return valid
+
+
 class SitemapGenerator(object):
     """
     Class for generating a sitemap.xml.
     """
 
-    xml_wrap = """<?xml version="1.0" encoding="UTF-8"?><?xml-stylesheet type="text/xsl" href="%(SITEURL)ssitemap-stylesheet.xsl"?>
-<urlset xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://www.sitemaps.org/schemas/sitemap/0.9 http://www.sitemaps.org/schemas/sitemap/0.9/sitemap.xsd" xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+    xml_wrap = """<?xml version="1.0" encoding="UTF-8"?>%(stylesheet)s
+<urlset xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://www.sitemaps.org/schemas/sitemap/0.9 http://www.sitemaps.org/schemas/sitemap/0.9/sitemap.xsd" xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"%(namespaces)s>
 %(urls)s
 </urlset>"""
 
@@ -37,6 +776,20 @@ class SitemapGenerator(object):
 {}
 </url>"""
 
+    xml_wrap_index = """<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+%(sitemaps)s
+</sitemapindex>"""
+
+    template_sitemap = """<sitemap>
+{}
+</sitemap>"""
+
+    template_stylesheet = '<?xml-stylesheet type="text/xsl" href="{}"?>'
+
+    # the file name of the stylesheet template and of the written stylesheet
+    stylesheet_filename = 'sitemap-stylesheet.xsl'
+
     settings_default = {
         'priorities': {
             'index': 1.0,
@@ -49,9 +802,45 @@ class SitemapGenerator(object):
             'articles': 'weekly',
             'pages': 'monthly',
             'others': 'monthly',
-        }
+        },
+        'sharding': False,
+        'shard_max_urls': 50000,
+        'shard_max_bytes': 50 * 1024 * 1024,
+        'incremental': False,
+        'gzip': False,
+        'gzip_compresslevel': 9,
+        'gzip_keep_plain': False,
+        'statistics': False,
+        'statistics_file': None,
+        'translations': False,
+        'images': False,
+        'videos': False,
+        'entries': False,
+        'changes': False,
+        'changes_file': 'sitemap-changes.json',
+        'rules': [],
+        'lastmod_source': None,
+        'validate': False,
+        'snapshot': False,
+        'stylesheet': True,
+        'lastmod_precision': 'date',
     }
 
+    # the pelican default of PAGINATION_PATTERNS
+    pagination_patterns_default = [
+        (1, '{name}{extension}', '{name}{extension}'),
+        (2, '{name}{number}{extension}', '{name}{number}{extension}'),
+    ]
+
+    # front matter keys overriding the rules for a single article or page
+    metadata_keys = ('sitemap_priority', 'sitemap_changefreq', 'sitemap_exclude')
+
+    # maximum number of <image:image> nodes per url allowed by the image sitemap extension
+    max_images = 1000
+
+    # bump if the cache layout or the rendered output changes to invalidate existing caches
+    cache_version = 5
+
     def __init__(self, context, settings, path, theme, output_path, **kwargs):
         """
         Initializes the generator class.
@@ -70,6 +859,7 @@ class SitemapGenerator(object):
         """
         self.pelican_settings = settings
         self.path_content = path
+        self.path_theme = theme
         self.path_output = output_path
         self.context = context
         if settings.get('TIMEZONE', None) is None:
@@ -81,7 +871,40 @@ class SitemapGenerator(object):
         # a slash is added here if it is not already present
         if not self.url_site.endswith('/'):
             self.url_site += '/'
-        self.settings = settings.get('EXTENDED_SITEMAP_PLUGIN', self.settings_default)
+        self.url_site = iri_to_uri(self.url_site)
+        self.settings = self.settings_default.copy()
+        self.settings.update(settings.get('EXTENDED_SITEMAP_PLUGIN', {}))
+        self.statistics = SitemapStatistics(enabled=bool(self.settings.get('statistics')))
+        if self.settings.get('lastmod_precision') not in ('date', 'datetime'):
+            raise ConfigurationError('The lastmod_precision setting must be "date" or "datetime"!')
+        self.renderer = SitemapRenderer.get(
+            self.url_site,
+            self.template_url,
+            self.settings.get('changefrequencies'),
+            self.settings.get('priorities'),
+            self.timezone,
+            self.settings.get('lastmod_precision')
+        )
+        # rendered hreflang alternates by content id, only used if translations are enabled
+        self.alternates = {}
+        # rendered image and video nodes by content source of the previous and the current build
+        self.media_cached = {}
+        self.media = None
+        # the entries exposed to other plugins, only collected if requested or if there are receivers of the signal
+        self.entries = None
+        self.rules = SitemapRules(self.settings.get('rules')) if self.settings.get('rules') else None
+        if self.settings.get('lastmod_source') not in (None, 'mtime', 'git'):
+            raise ConfigurationError('The lastmod_source setting must be None, "mtime" or "git"!')
+        # modification dates of the content files by source path, only used if a lastmod source is configured
+        self.source_dates = None
+        # the validator of the urls, only exists during generate_output if validation is enabled
+        self.validator = None
+        # (section name, entries) tuples written instead of the content of the context, see load_snapshot and scan_output
+        self.sections = None
+        # the recorded sections of the current build, only exists during generate_output if the snapshot is enabled
+        self.snapshot = None
+        # (absolute url, newest lastmod, number of urls) tuples of the written <urlset> files, set by generate_output
+        self.sitemaps = None
 
     def generate_output(self, writer):
         """
@@ -89,43 +912,767 @@ class SitemapGenerator(object):
         :param writer: the writer instance
         :type writer: pelican.writers.Writer
         """
-        # write xml stylesheet
-        with codecs_open(os.path.join(os.path.dirname(__file__), 'sitemap-stylesheet.xsl'), 'r', encoding='utf-8') as fd_origin:
-            with codecs_open(os.path.join(self.path_output, 'sitemap-stylesheet.xsl'), 'w', encoding='utf-8') as fd_destination:
-                xsl = fd_origin.read()
-                # replace some template markers
-                # TODO use pelican template magic
-                xsl = xsl.replace('{{ SITENAME }}', self.context.get('SITENAME'))
-                fd_destination.write(xsl)
+        # the content dependent steps are skipped if the sections are given
+        from_content = self.sections is None
 
-        # will contain the url nodes as text
-        urls = ''
+        if self.settings.get('lastmod_source') and from_content:
+            with self.statistics.measure('lastmod_source'):
+                self.source_dates = self.__get_source_dates()
 
-        # get all articles sorted by time
-        articles_sorted = sorted(self.context['articles'], key=self.__get_date_key, reverse=True)
+        fingerprint = None
+        if self.settings.get('incremental') and from_content:
+            with self.statistics.measure('fingerprint'):
+                cache = self.__load_cache(
+                    'extended_sitemap',
+                    {'fingerprint': None, 'files': [], 'sitemaps': [], 'entries': None}
+                )
+                fingerprint = self.__get_fingerprint()
+            if fingerprint == cache.get('fingerprint') and all(
+                os.path.exists(os.path.join(self.path_output, filename)) for filename in cache.get('files')
+            ) and (cache.get('entries') is not None or not self.__collects_entries()):
+                logger.debug('extended_sitemap: content unchanged, keeping the existing sitemap files')
+                self.sitemaps = cache.get('sitemaps')
+                if self.__collects_entries():
+                    self.entries = [SitemapEntry(*values) for values in cache.get('entries')]
+                    self.__finish_entries()
+                self.__report_statistics()
+                return
 
-        # get all pages with date/modified date
-        pages_with_date = list(
-            filter(
-                lambda p: getattr(p, 'modified', False) or getattr(p, 'date', False),
-                self.context.get('pages')
+        if (self.settings.get('images') or self.settings.get('videos')) and from_content:
+            cache = self.__load_cache('extended_sitemap_media', {'settings': None, 'media': {}})
+            if cache.get('settings') == self.__get_settings_digest():
+                self.media_cached = cache.get('media')
+            self.media = {}
+
+        if self.__collects_entries():
+            self.entries = []
+
+        if self.settings.get('validate'):
+            self.validator = SitemapValidator(self.url_site)
+
+        if self.settings.get('snapshot') and from_content:
+            self.snapshot = []
+
+        files = self.__get_output_filenames('sitemap.xml')
+        if self.settings.get('stylesheet') is True:
+            # write xml stylesheet
+            with self.statistics.measure('stylesheet'):
+                xsl = self.__get_stylesheet_template().render(self.context)
+                # the stylesheet is never compressed, it is only rewritten if changed
+                with SitemapFile(os.path.join(self.path_output, self.stylesheet_filename), statistics=self.statistics) as fd:
+                    fd.write(xsl)
+            files.insert(0, self.stylesheet_filename)
+
+        # the time spent in the url node generators is accounted to their own phases
+        with self.statistics.measure('write'):
+            if self.settings.get('sharding'):
+                sitemaps = self.__write_sharded_sitemap()
+                for filename, lastmod, count in sitemaps:
+                    files.extend(self.__get_output_filenames(filename))
+            else:
+                # write the final sitemap file, the url nodes are streamed into the file as they are created
+                with self.__open_output_file('sitemap.xml') as fd:
+                    newest, count = self.__write_urlset(fd, self.__render_entries(chain.from_iterable(
+                        entries for name, entries in self.__generate_sections()
+                    )))
+                sitemaps = [('sitemap.xml', newest, count)]
+            self.sitemaps = [
+                (self.__get_sitemap_loc(filename), lastmod, count) for filename, lastmod, count in sitemaps
+            ]
+
+        if fingerprint is not None:
+            self.__save_cache('extended_sitemap', {
+                'fingerprint': fingerprint,
+                'files': files,
+                'sitemaps': self.sitemaps,
+                # only stored if collected, a skipped build hands them to the other plugins again
+                'entries': None if self.entries is None else [
+                    (entry.loc, entry.lastmod, entry.changefreq, entry.priority, entry.type) for entry in self.entries
+                ],
+            })
+
+        if self.snapshot is not None:
+            self.__save_cache('extended_sitemap_snapshot', {
+                'url_site': self.url_site,
+                'extensions': dict((key, self.settings.get(key)) for key in ('translations', 'images', 'videos')),
+                'sections': self.snapshot,
+            })
+            self.snapshot = None
+
+        if self.media is not None:
+            # only the media of the current content is kept
+            self.__save_cache('extended_sitemap_media', {
+                'settings': self.__get_settings_digest(),
+                'media': self.media,
+            })
+
+        if self.entries is not None:
+            self.__finish_entries()
+
+        if self.rules is not None:
+            for index, hits in enumerate(self.rules.hits):
+                logger.debug('extended_sitemap: rule %d matched %d urls', index, hits)
+
+        if self.validator is not None:
+            logger.debug(
+                'extended_sitemap: %d duplicate urls, %d urls outside of the site url, %d too long urls',
+                self.validator.duplicates,
+                self.validator.external,
+                self.validator.too_long
             )
-        )
-        pages_with_date_sorted = sorted(pages_with_date, key=self.__get_date_key, reverse=True)
+            self.validator = None
+
+        self.__report_statistics()
 
-        # get all pages without date
-        pages_without_date = list(
-            filter(
-                lambda p: getattr(p, 'modified', None) is None and getattr(p, 'date', None) is None,
-                self.context.get('pages')
+    def load_snapshot(self):
+        """
+        Uses the entries saved by the previous build with the snapshot setting as the sections to write, instead of the
+        content of the context. The urls keep the lastmod values, rule overrides and extra nodes of the build, the
+        priorities and change frequencies of their content types and the output options are taken from the settings.
+        :returns: whether there is a usable snapshot
+        :rtype: bool
+        """
+        snapshot = self.__load_cache('extended_sitemap_snapshot', {'url_site': None, 'extensions': {}, 'sections': None})
+        if snapshot.get('sections') is None:
+            return False
+        if snapshot.get('url_site') != self.url_site:
+            logger.warning(
+                'extended_sitemap: the snapshot was taken for the site url %s instead of %s',
+                snapshot.get('url_site'),
+                self.url_site
             )
+            return False
+        # the extra nodes of the entries need the namespaces of the extensions enabled in the build
+        self.settings.update(snapshot.get('extensions'))
+        self.sections = snapshot.get('sections')
+        return True
+
+    def scan_output(self):
+        """
+        Uses the html files in the output dir as the sections to write, instead of the content of the context.
+        The index.html in the output dir is the index page, all other files are pages. Files named index.html are
+        referenced by the url of their dir. The lastmod value is the modification time of the file, the rules are
+        applied to the urls. The dirs of the drafts and of the static theme files are skipped.
+        """
+        dirs_skipped = self.__get_unlisted_dirs()
+        entries = []
+        for path_dir, dirnames, filenames in os.walk(self.path_output):
+            path_relative = os.path.relpath(path_dir, self.path_output).replace(os.sep, '/')
+            prefix = '' if path_relative == '.' else path_relative + '/'
+            dirnames[:] = sorted(dirname for dirname in dirnames if prefix + dirname not in dirs_skipped)
+            for filename in sorted(filenames):
+                if not filename.endswith(('.html', '.htm')):
+                    continue
+                url = prefix if filename in ('index.html', 'index.htm') else prefix + filename
+                loc = self.renderer.join_url(url)
+                content_type = self.__apply_rules(None, 'index' if url == '' else 'pages', loc)
+                if content_type is None:
+                    continue
+                lastmod = self.renderer.format_date(
+                    datetime.fromtimestamp(os.path.getmtime(os.path.join(path_dir, filename)), self.timezone)
+                )
+                entries.append((loc, lastmod, content_type, None))
+        # the index page comes first
+        entries.sort(key=lambda entry: entry[0] != self.url_site)
+        self.sections = [('pages', entries)]
+
+    def __get_unlisted_dirs(self):
+        """
+        Returns the dirs of the output dir that must not be listed in the sitemap: the static dir of the theme and the
+        dirs of the DRAFT_*SAVE_AS settings up to their first placeholder.
+        :returns: the dirs relative to the output dir
+        :rtype: set
+        """
+        dirs = set()
+        for key in ('DRAFT_SAVE_AS', 'DRAFT_LANG_SAVE_AS', 'DRAFT_PAGE_SAVE_AS', 'DRAFT_PAGE_LANG_SAVE_AS'):
+            save_as = self.pelican_settings.get(key)
+            if not save_as:
+                continue
+            parts = []
+            for part in save_as.strip('/').split('/')[:-1]:
+                if '{' in part:
+                    break
+                parts.append(part)
+            if parts:
+                dirs.add('/'.join(parts))
+            else:
+                logger.warning(
+                    'extended_sitemap: the drafts of %s are not saved in an own dir, they cannot be told apart from '
+                    'published content when scanning the output dir',
+                    key
+                )
+        if self.pelican_settings.get('THEME_STATIC_DIR'):
+            dirs.add(self.pelican_settings.get('THEME_STATIC_DIR').strip('/'))
+        return dirs
+
+    def __get_stylesheet_template(self):
+        """
+        Returns the template of the stylesheet. A sitemap-stylesheet.xsl in the THEME_TEMPLATES_OVERRIDES dirs or in the
+        templates dir of the theme takes precedence over the one of this package.
+        The jinja environment is created with the JINJA_ENVIRONMENT options once per process and search path.
+        :rtype: jinja2.Template
+        """
+        paths = list(self.pelican_settings.get('THEME_TEMPLATES_OVERRIDES') or [])
+        if self.path_theme:
+            paths.append(os.path.join(self.path_theme, 'templates'))
+        paths.append(os.path.dirname(os.path.abspath(__file__)))
+        options = self.pelican_settings.get('JINJA_ENVIRONMENT') or {}
+        key = (tuple(paths), json.dumps(options, sort_keys=True, default=str))
+        environment = _stylesheet_environments.get(key)
+        if environment is None:
+            # values like the SITENAME must be xml escaped
+            environment = Environment(loader=FileSystemLoader(paths), **dict(options, autoescape=True))
+            _stylesheet_environments[key] = environment
+        return environment.get_template(self.stylesheet_filename)
+
+    def __get_stylesheet_instruction(self):
+        """
+        Returns the processing instruction referencing the stylesheet, depending on the stylesheet setting.
+        :rtype: str
+        """
+        stylesheet = self.settings.get('stylesheet')
+        if not stylesheet:
+            return ''
+        if stylesheet is True:
+            stylesheet = self.stylesheet_filename
+        return self.template_stylesheet.format(escape(self.renderer.join_url(stylesheet), {'"': '&quot;'}))
+
+    def __collects_entries(self):
+        """
+        Returns whether the entries are collected for other plugins.
+        :rtype: bool
+        """
+        return bool(
+            self.settings.get('entries') or self.settings.get('changes') or sitemap_generated.receivers
+        )
+
+    def __finish_entries(self):
+        """
+        Writes the changes file if configured, puts the collected entries on the context and sends them to the
+        receivers of the sitemap_generated signal.
+        """
+        if self.settings.get('changes'):
+            with self.statistics.measure('changes'):
+                self.__write_changes()
+        self.context['sitemap_entries'] = self.entries
+        sitemap_generated.send(self, entries=self.entries)
+
+    def __write_changes(self):
+        """
+        Writes the urls added, updated and removed since the previous build into the changes file and stores the
+        lastmod values of the current build for the next one.
+        Without a previous build, all urls are listed as added and the changes are marked as initial.
+        """
+        cache = self.__load_cache('extended_sitemap_changes', {'lastmods': None})
+        previous = cache.get('lastmods')
+        current = {}
+        added = []
+        updated = []
+        for entry in self.entries:
+            current[entry.loc] = entry.lastmod
+            if previous is None or entry.loc not in previous:
+                added.append(entry.loc)
+            elif previous[entry.loc] != entry.lastmod:
+                updated.append(entry.loc)
+        removed = [] if previous is None else sorted(loc for loc in previous if loc not in current)
+
+        with SitemapFile(os.path.join(self.path_output, self.settings.get('changes_file'))) as fd:
+            fd.write(json.dumps(
+                {'initial': previous is None, 'added': added, 'updated': updated, 'removed': removed},
+                indent=2,
+                sort_keys=True
+            ))
+        self.__save_cache('extended_sitemap_changes', {'lastmods': current})
+
+    def __create_sitemap_entry(self, loc, lastmod, content_type):
+        """
+        Creates the entry exposed to other plugins.
+        :param loc: the absolute url
+        :type loc: str
+        :param lastmod: the formatted modification date
+        :type lastmod: str | None
+        :param content_type: the content type or a (content type, change frequency, priority) tuple of a rule override
+        :type content_type: str | tuple
+        :rtype: SitemapEntry
+        """
+        if isinstance(content_type, tuple):
+            # rule override
+            return SitemapEntry(loc, lastmod, content_type[1], content_type[2], content_type[0])
+        return SitemapEntry(
+            loc,
+            lastmod,
+            self.settings.get('changefrequencies')[content_type],
+            self.settings.get('priorities')[content_type],
+            content_type
+        )
+
+    def __collect_entries(self, entries):
+        append = self.entries.append
+        for entry in entries:
+            append(self.__create_sitemap_entry(*entry[:3]))
+            yield entry
+
+    def __validate_entries(self, entries):
+        validate = self.validator.validate
+        for entry in entries:
+            validate(entry[0])
+            yield entry
+
+    def __report_statistics(self):
+        """
+        Logs the collected statistics at debug level and writes them into the configured statistics file.
+        """
+        if not self.statistics.enabled:
+            return
+        statistics = self.statistics.as_dict()
+        for phase, duration in statistics['timings'].items():
+            logger.debug('extended_sitemap: %s took %.3fs', phase, duration)
+        for phase, count in statistics['nodes'].items():
+            logger.debug('extended_sitemap: %d url nodes for %s', count, phase)
+        logger.debug(
+            'extended_sitemap: %d url nodes, %d bytes written in %.3fs',
+            statistics['total_nodes'],
+            statistics['bytes_written'],
+            statistics['total_time']
+        )
+        if self.settings.get('statistics_file'):
+            with codecs_open(os.path.join(self.path_output, self.settings.get('statistics_file')), 'w', encoding='utf-8') as fd:
+                fd.write(json.dumps(statistics, indent=2))
+
+    def __open_output_file(self, filename):
+        """
+        Opens the sitemap file with the given name in the output dir, compressed and/or plain depending on the settings.
+        :param filename: the file name of the plain file
+        :type filename: str
+        :rtype: SitemapFile
+        """
+        compress = self.settings.get('gzip')
+        return SitemapFile(
+            os.path.join(self.path_output, filename),
+            plain=not compress or self.settings.get('gzip_keep_plain'),
+            compresslevel=self.settings.get('gzip_compresslevel') if compress else None,
+            statistics=self.statistics
+        )
+
+    def __get_output_filenames(self, filename):
+        """
+        Returns the names of the files written for the sitemap file with the given name.
+        :param filename: the file name of the plain file
+        :type filename: str
+        :rtype: list
+        """
+        if not self.settings.get('gzip'):
+            return [filename]
+        if self.settings.get('gzip_keep_plain'):
+            return [filename, filename + '.gz']
+        return [filename + '.gz']
+
+    def __get_cache_path(self, name):
+        """
+        Returns the path of the cache file with the given name within the CACHE_PATH of pelican.
+        :param name: the name of the cache
+        :type name: str
+        :rtype: str
+        """
+        return os.path.join(self.pelican_settings.get('CACHE_PATH', 'cache'), '{}.cache'.format(name))
+
+    def __load_cache(self, name, empty):
+        """
+        Loads the cache of the previous build. Returns the given empty cache if there is none or if it is unusable.
+        :param name: the name of the cache
+        :type name: str
+        :param empty: the cache data to use if there is no usable cache
+        :type empty: dict
+        :returns: the cache data
+        :rtype: dict
+        """
+        path = self.__get_cache_path(name)
+        try:
+            with open(path, 'rb') as fd:
+                cache = pickle.load(fd)
+        except (IOError, OSError):
+            return empty
+        except Exception as e:
+            logger.warning('extended_sitemap: cannot load cache %s, regenerating (%s)', path, e)
+            return empty
+        if not isinstance(cache, dict) or cache.get('version') != self.cache_version:
+            return empty
+        return cache
+
+    def __save_cache(self, name, cache):
+        """
+        Stores the given cache data for the next build.
+        :param name: the name of the cache
+        :type name: str
+        :param cache: the cache data
+        :type cache: dict
+        """
+        cache['version'] = self.cache_version
+        path = self.__get_cache_path(name)
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as fd:
+                pickle.dump(cache, fd, pickle.HIGHEST_PROTOCOL)
+        except (IOError, OSError) as e:
+            logger.warning('extended_sitemap: cannot save cache %s (%s)', path, e)
+
+    def __get_settings_digest(self):
+        """
+        Returns a digest of everything besides the content that influences the rendering of the url nodes.
+        :rtype: str
+        """
+        digest = hashlib.sha1()
+        digest.update(json.dumps(self.settings, sort_keys=True, default=str).encode('utf-8'))
+        digest.update(self.template_url.encode('utf-8'))
+        digest.update(str(self.cache_version).encode('utf-8'))
+        return digest.hexdigest()
+
+    def __get_fingerprint(self):
+        """
+        Returns a fingerprint of all inputs of the sitemap generation in a single pass over the content, without sorting it.
+        If the fingerprint equals the one of the previous build, the output would be the same.
+        The values of the content are collected as plain tuples and serialized at once, the dates by their fields
+        instead of as formatted strings, so the fingerprint costs a fraction of rendering the sitemap. The taxonomy
+        pages are covered by their urls and the positions of their articles.
+        :rtype: str
+        """
+        digest = hashlib.sha1()
+
+        def update(*values):
+            digest.update('\x1f'.join('' if value is None else '{}'.format(value) for value in values).encode('utf-8'))
+            digest.update(b'\x1e')
+
+        update(self.__get_settings_digest(), self.url_site, self.context.get('SITENAME'))
+        update(self.xml_wrap, self.xml_wrap_index, self.template_sitemap, self.template_stylesheet)
+        if self.settings.get('stylesheet') is True:
+            template = self.__get_stylesheet_template()
+            update(template.filename, get_file_digest(template.filename))
+        update(self.context.get('CATEGORY_URL'), self.context.get('TAG_URL'), self.context.get('AUTHOR_URL'))
+        update(
+            self.pelican_settings.get('DEFAULT_PAGINATION'),
+            self.pelican_settings.get('DEFAULT_ORPHANS'),
+            json.dumps(self.pelican_settings.get('PAGINATED_TEMPLATES'), sort_keys=True),
+            self.pelican_settings.get('PAGINATION_PATTERNS'),
         )
-        pages_without_date_sorted = sorted(pages_without_date, key=self.__get_title_key, reverse=False)
+        # the urls of the pages of paginated listings are built from these
+        update(*(self.pelican_settings.get(key) for key in (
+            'INDEX_SAVE_AS', 'INDEX_URL', 'CATEGORY_SAVE_AS', 'TAG_SAVE_AS', 'AUTHOR_SAVE_AS'
+        )))
+        for direct_template in self.context.get('DIRECT_TEMPLATES'):
+            update(
+                'direct_template',
+                direct_template,
+                self.__get_direct_template_url(direct_template),
+                self.pelican_settings.get('{}_SAVE_AS'.format(direct_template.upper())),
+                self.pelican_settings.get('{}_URL'.format(direct_template.upper())),
+            )
+        values = []
+        append = values.append
+        # the dates are collected separately and converted at once, missing dates are represented by a placeholder
+        dates = []
+        append_date = dates.append
+        missing = datetime(1, 1, 1)
+
+        media = self.settings.get('images') or self.settings.get('videos')
+        translations = self.settings.get('translations')
+        source_dates = self.source_dates
+        metadata_keys = frozenset(self.metadata_keys)
+        for content_type in ('articles', 'pages'):
+            append((content_type, len(self.context.get(content_type))))
+            for content in self.context.get(content_type):
+                append((content.url, getattr(content, 'title', None)))
+                append_date(getattr(content, 'modified', None) or missing)
+                append_date(getattr(content, 'date', None) or missing)
+                metadata = getattr(content, 'metadata', None)
+                if metadata and not metadata_keys.isdisjoint(metadata):
+                    append(tuple('{}'.format(metadata.get(key)) for key in self.metadata_keys))
+                if source_dates is not None:
+                    append_date(source_dates.get(getattr(content, 'source_path', None)) or missing)
+                if media:
+                    append(getattr(content, '_content', None))
+                if translations:
+                    for translation in getattr(content, 'translations', None) or []:
+                        append((
+                            translation.url,
+                            getattr(translation, 'lang', None),
+                            getattr(translation, 'title', None),
+                        ))
+                        append_date(getattr(translation, 'modified', None) or missing)
+                        append_date(getattr(translation, 'date', None) or missing)
+                        if source_dates is not None:
+                            append_date(source_dates.get(getattr(translation, 'source_path', None)) or missing)
+                    append(getattr(content, 'lang', None))
+        # the fields of the dates and the names of their timezones
+        append(list(map(attrgetter('year', 'month', 'day', 'hour', 'minute', 'second', 'microsecond'), dates)))
+        tzinfos = list(map(attrgetter('tzinfo'), dates))
+        zones = dict((tzinfo, '{!r}'.format(tzinfo)) for tzinfo in set(tzinfos))
+        append(list(map(zones.get, tzinfos)))
+        # the urls of the taxonomy pages and their articles in order, referred to by their position in the articles
+        get_position = dict(zip(map(id, self.context['articles']), range(len(self.context['articles'])))).get
+        for key in ('categories', 'tags', 'authors'):
+            for url_wrapper, articles in self.context.get(key) or []:
+                append((key, '{}'.format(url_wrapper), url_wrapper.url, getattr(url_wrapper, 'save_as', None)))
+                append(tuple(map(get_position, map(id, articles))))
+        # marshal format 2 has no references between the values, so the same values always result in the same bytes
+        try:
+            digest.update(marshal.dumps(values, 2))
+        except ValueError:
+            # values of other types than the builtin ones, e.g. titles as markup strings
+            digest.update('{!r}'.format(values).encode('utf-8'))
+        return digest.hexdigest()
+
+    def __write_urlset(self, fd, nodes):
+        """
+        Writes the <urlset> document with the given url nodes into the given file handle.
+        :param fd: the file handle to write into
+        :type fd: file
+        :param nodes: iterable of (url node text, lastmod) tuples
+        :type nodes: collections.Iterable
+        :returns: tuple of the newest lastmod and the number of url nodes
+        :rtype: tuple
+        """
+        head, foot = self.xml_wrap.split('%(urls)s')
+        fd.write(head % {'stylesheet': self.__get_stylesheet_instruction(), 'namespaces': self.__get_namespaces()})
+        newest = None
+        count = 0
+        for node, lastmod in nodes:
+            fd.write(node)
+            count += 1
+            if lastmod is not None and (newest is None or lastmod > newest):
+                newest = lastmod
+        fd.write(foot)
+        return newest, count
+
+    def __get_sitemap_loc(self, filename):
+        """
+        Returns the absolute url of the sitemap file with the given name, of the compressed file if there is one.
+        :param filename: the file name of the plain file
+        :type filename: str
+        :rtype: str
+        """
+        return urljoin(self.url_site, self.__get_output_filenames(filename)[-1])
+
+    @classmethod
+    def render_sitemap(cls, loc, lastmod):
+        """
+        Renders the <sitemap> node of a sitemap index.
+        :param loc: the absolute url of the sitemap file
+        :type loc: str
+        :param lastmod: the newest lastmod of the urls in the sitemap file
+        :type lastmod: str | None
+        :rtype: str
+        """
+        output = '<loc>{}</loc>'.format(escape(loc))
+        if lastmod is not None:
+            output += '\n<lastmod>{}</lastmod>'.format(lastmod)
+        return cls.template_sitemap.format(output)
+
+    def __get_namespaces(self):
+        """
+        Returns the declarations of the additional xml namespaces used by the enabled extensions.
+        :rtype: str
+        """
+        namespaces = ''
+        if self.settings.get('translations'):
+            namespaces += ' xmlns:xhtml="http://www.w3.org/1999/xhtml"'
+        if self.settings.get('images'):
+            namespaces += ' xmlns:image="http://www.google.com/schemas/sitemap-image/1.1"'
+        if self.settings.get('videos'):
+            namespaces += ' xmlns:video="http://www.google.com/schemas/sitemap-video/1.1"'
+        return namespaces
+
+    def __write_sharded_sitemap(self):
+        """
+        Writes the url nodes into shard files per section (sitemap-articles-1.xml, sitemap-pages-1.xml, ...)
+        and a sitemap.xml <sitemapindex> referencing all of them.
+        Shards are limited to the configured shard_max_urls and shard_max_bytes.
+        :returns: list of (plain file name, newest lastmod, number of urls) tuples of the written shards
+        :rtype: list
+        """
+        # group the sections by shard name, the index page goes along with the pages
+        groups = OrderedDict([('articles', []), ('pages', []), ('taxonomies', [])])
+        for name, entries in self.__generate_sections():
+            groups.setdefault(name, []).append(entries)
+
+        sitemaps = []
+        for name, parts in groups.items():
+            sitemaps.extend(self.__write_shards(name, self.__render_entries(chain.from_iterable(parts))))
+
+        with self.__open_output_file('sitemap.xml') as fd:
+            head, foot = self.xml_wrap_index.split('%(sitemaps)s')
+            fd.write(head)
+            for filename, lastmod, count in sitemaps:
+                # reference the compressed shards if there are any
+                fd.write(self.render_sitemap(self.__get_sitemap_loc(filename), lastmod))
+            fd.write(foot)
+        return sitemaps
+
+    def __write_shards(self, name, nodes):
+        """
+        Writes the given url nodes into as many sitemap-<name>-<number>.xml files as required.
+        Files of shards that are not used anymore are removed.
+        :param name: the name of the shard group
+        :type name: str
+        :param nodes: iterable of (url node text, lastmod) tuples
+        :type nodes: collections.Iterable
+        :returns: list of (filename, newest lastmod, number of urls) tuples of the written shards
+        :rtype: list
+        """
+        head, foot = self.xml_wrap.split('%(urls)s')
+        head = head % {'stylesheet': self.__get_stylesheet_instruction(), 'namespaces': self.__get_namespaces()}
+        size_frame = len(head.encode('utf-8')) + len(foot.encode('utf-8'))
+        max_urls = self.settings.get('shard_max_urls')
+        max_bytes = self.settings.get('shard_max_bytes')
+
+        shards = []
+        fd = None
+        count = size = 0
+        newest = None
+        try:
+            for node, lastmod in nodes:
+                size_node = len(node.encode('utf-8'))
+                if fd is not None and (count >= max_urls or size + size_node > max_bytes):
+                    fd.write(foot)
+                    fd.close()
+                    shards.append((filename, newest, count))
+                    fd = None
+                if fd is None:
+                    filename = 'sitemap-{}-{}.xml'.format(name, len(shards) + 1)
+                    fd = self.__open_output_file(filename)
+                    fd.write(head)
+                    count = 0
+                    size = size_frame
+                    newest = None
+                fd.write(node)
+                count += 1
+                size += size_node
+                if lastmod is not None and (newest is None or lastmod > newest):
+                    newest = lastmod
+        except BaseException:
+            # like the context manager of the single file, no half written shard is left in the output dir
+            if fd is not None:
+                fd.discard()
+            raise
+        if fd is not None:
+            fd.write(foot)
+            fd.close()
+            shards.append((filename, newest, count))
 
-        # join them, first date sorted, then title sorted
-        pages_sorted = pages_with_date_sorted + pages_without_date_sorted
+        # remove outdated plain and compressed shards of previous runs
+        number = len(shards) + 1
+        while True:
+            paths = [
+                path for path in (
+                    os.path.join(self.path_output, 'sitemap-{}-{}.xml{}'.format(name, number, suffix))
+                    for suffix in ('', '.gz')
+                ) if os.path.exists(path)
+            ]
+            if not paths:
+                break
+            for path in paths:
+                os.remove(path)
+            number += 1
 
-        # the landing page
+        return shards
+
+    def __generate_sections(self):
+        """
+        Generator yielding the sections of the sitemap in the order they are written, from the content of the context
+        or from the given sections. The entries of the sections are recorded for the snapshot if enabled.
+        Every section is a tuple of the shard name and a generator of (loc, lastmod, content type, extra) entries.
+        :returns: generator of sections
+        :rtype: collections.Iterator
+        """
+        if self.sections is None:
+            sections = self.__generate_content_sections()
+        else:
+            sections = ((name, self.statistics.measure_nodes(name, entries)) for name, entries in self.sections)
+        for name, entries in sections:
+            if self.snapshot is not None:
+                recorded = []
+                self.snapshot.append((name, recorded))
+                entries = self.__record_entries(entries, recorded)
+            yield name, entries
+
+    @staticmethod
+    def __record_entries(entries, recorded):
+        append = recorded.append
+        for entry in entries:
+            append(entry)
+            yield entry
+
+    def __generate_content_sections(self):
+        """
+        Generator yielding the sections of the sitemap from the content of the context.
+        :returns: generator of (shard name, entries) tuples
+        :rtype: collections.Iterator
+        """
+        articles_sorted, pages_sorted = self.__get_sorted_content()
+        yield 'pages', self.statistics.measure_nodes('index', self.__generate_index_entries(articles_sorted, pages_sorted))
+        yield 'articles', self.statistics.measure_nodes('articles', self.__generate_content_entries(articles_sorted, 'articles'))
+        yield 'pages', self.statistics.measure_nodes('pages', self.__generate_content_entries(pages_sorted, 'pages'))
+        yield 'taxonomies', self.__generate_taxonomy_entries(articles_sorted)
+
+    def __get_sorted_content(self):
+        """
+        Returns the articles and pages in the order they appear in the sitemap.
+        :returns: tuple of sorted articles and sorted pages
+        :rtype: tuple
+        """
+        articles = self.context['articles']
+        pages = self.context.get('pages')
+        if self.settings.get('translations'):
+            with self.statistics.measure('translations'):
+                articles = self.__add_translations(articles)
+                pages = self.__add_translations(pages)
+
+        # get all articles sorted by time
+        with self.statistics.measure('sort_articles'):
+            articles_sorted = sort_content(articles)
+
+        # get all pages, first date sorted, then title sorted
+        with self.statistics.measure('sort_pages'):
+            pages_sorted = sort_content(pages)
+
+        return articles_sorted, pages_sorted
+
+    def __add_translations(self, contents):
+        """
+        Returns the given contents along with all their translations and renders the hreflang alternates of every
+        translation group once into self.alternates, keyed by the ids of the group members.
+        :param contents: the articles or pages in the default language
+        :type contents: list
+        :returns: the contents and their translations
+        :rtype: list
+        """
+        contents_translated = list(contents)
+        seen = set(id(content) for content in contents)
+        for content in contents:
+            translations = getattr(content, 'translations', None)
+            if not translations or id(content) in self.alternates:
+                continue
+            group = sorted([content] + list(translations), key=lambda member: member.lang)
+            alternates = ''.join(
+                self.renderer.render_alternate(member.lang, self.renderer.join_url(member.url)) for member in group
+            )
+            for member in group:
+                self.alternates[id(member)] = alternates
+                if id(member) not in seen:
+                    seen.add(id(member))
+                    contents_translated.append(member)
+        return contents_translated
+
+    def __generate_index_entries(self, articles_sorted, pages_sorted):
+        """
+        Generator yielding the entry of the landing page.
+        :param articles_sorted: the articles sorted by date
+        :type articles_sorted: list
+        :param pages_sorted: the pages sorted by date and title
+        :type pages_sorted: list
+        :returns: generator of (loc, lastmod, content type, extra) entries
+        :rtype: collections.Iterator
+        """
         if 'index' in self.context.get('DIRECT_TEMPLATES'):
             # assume that the index page has changed with the most current article or page
             # use the first article or page if no articles
@@ -135,56 +1682,232 @@ class SitemapGenerator(object):
             elif len(pages_sorted) > 0:
                 index_reference = pages_sorted[0]
 
-            if index_reference is not None:
-                urls += self.__create_url_node_for_content(
+            per_page = self.__get_per_page('index')
+            if per_page and len(articles_sorted) > 0:
+                for entry in self.__generate_listing_entries(
+                    self.pelican_settings.get('INDEX_SAVE_AS', 'index.html'),
+                    self.pelican_settings.get('INDEX_URL', 'index.html'),
+                    self.context['articles'],
+                    per_page,
+                    self.url_site,
+                    'index'
+                ):
+                    if entry is not None:
+                        yield entry
+            elif index_reference is not None:
+                modification_time = None
+                if self.source_dates is not None:
+                    # the order is based on the metadata, the newest date of the lastmod source may be another one
+                    for content in articles_sorted or pages_sorted:
+                        date = self.__get_date_key(content)
+                        if date is not None and (modification_time is None or date > modification_time):
+                            modification_time = date
+                entry = self.__create_entry(
                     index_reference,
                     'index',
                     url=self.url_site,
+                    modification_time=modification_time,
                 )
+                if entry is not None:
+                    yield entry
 
-        # process articles
-        for article in articles_sorted:
-            urls += self.__create_url_node_for_content(
-                article,
-                'articles',
-                url=urljoin(self.url_site, article.url)
-            )
+    def __generate_content_entries(self, contents, content_type):
+        """
+        Generator yielding the entries of the given articles or pages.
+        :param contents: the sorted content instances
+        :type contents: list
+        :param content_type: the type of the given contents to match settings.EXTENDED_SITEMAP_PLUGIN
+        :type content_type: str
+        :returns: generator of (loc, lastmod, content type, extra) entries
+        :rtype: collections.Iterator
+        """
+        alternates = self.alternates
+        for content in contents:
+            loc = self.renderer.join_url(content.url)
+            rule_type = self.__apply_rules(content, content_type, loc)
+            if rule_type is None:
+                continue
+            extra = alternates.get(id(content))
+            if self.media is not None:
+                media = self.__get_media(content, loc)
+                if media:
+                    extra = media if extra is None else extra + media
+            yield self.__create_entry(content, rule_type, url=loc, extra=extra, rules=False)
 
-        # process pages
-        for page in pages_sorted:
-            urls += self.__create_url_node_for_content(
-                page,
-                'pages',
-                url=urljoin(self.url_site, page.url)
-            )
+    def __get_media(self, content, loc):
+        """
+        Returns the rendered image and video nodes of the given content.
+        The content html is only parsed if it changed since the previous build, otherwise the cached nodes are used.
+        :param content: the article or page
+        :type content: pelican.contents.Content
+        :param loc: the absolute url of the content
+        :type loc: str
+        :returns: the rendered nodes
+        :rtype: str | None
+        """
+        html = getattr(content, '_content', None)
+        if not html:
+            return None
+        key = getattr(content, 'source_path', None) or loc
+        digest = hashlib.sha1((loc + '\x00' + html).encode('utf-8')).hexdigest()
+        cached = self.media_cached.get(key)
+        if cached is not None and cached[0] == digest:
+            media = cached[1]
+        else:
+            with self.statistics.measure('media'):
+                media = self.__extract_media(content, loc)
+        self.media[key] = (digest, media)
+        return media
+
+    def __extract_media(self, content, loc):
+        """
+        Parses the html of the given content and renders its image and video nodes.
+        Sources that are no http or https urls after resolving them, like inline data: URIs, are skipped.
+        :param content: the article or page
+        :type content: pelican.contents.Content
+        :param loc: the absolute url of the content, relative sources are resolved against it
+        :type loc: str
+        :returns: the rendered nodes
+        :rtype: str
+        """
+        parser = SitemapMediaParser()
+        parser.feed(content.content)
+        parser.close()
+
+        media = ''
+        if self.settings.get('images'):
+            images = []
+            seen = set()
+            for src in parser.images:
+                src = iri_to_uri(urljoin(loc, src))
+                if src not in seen and self.__is_web_url(src):
+                    seen.add(src)
+                    images.append(src)
+                    if len(images) >= self.max_images:
+                        break
+            media += ''.join(self.renderer.render_image(src) for src in images)
+        if self.settings.get('videos'):
+            title = getattr(content, 'title', '')
+            for video in parser.videos:
+                # thumbnail and video file are required by the video sitemap extension
+                if not video['src'] or not video['poster']:
+                    continue
+                src = iri_to_uri(urljoin(loc, video['src']))
+                poster = iri_to_uri(urljoin(loc, video['poster']))
+                if self.__is_web_url(src) and self.__is_web_url(poster):
+                    media += self.renderer.render_video(poster, video['title'] or title, video['title'] or title, src)
+        return media
+
+    @staticmethod
+    def __is_web_url(url):
+        """
+        Returns whether the given absolute url is an http or https url, as required by the image and video extensions.
+        :param url: the absolute url
+        :type url: str
+        :rtype: bool
+        """
+        return urlsplit(url).scheme in ('http', 'https')
+
+    def __generate_taxonomy_entries(self, articles_sorted):
+        """
+        Generator yielding the entries of categories, tags, authors and the DIRECT_TEMPLATES but "index".
+        :param articles_sorted: the articles sorted by date
+        :type articles_sorted: list
+        :returns: generator of (loc, lastmod, content type, extra) entries
+        :rtype: collections.Iterator
+        """
+        with self.statistics.measure('taxonomy_dates'):
+            newest, newest_by_wrapper = self.__get_newest_dates()
 
         # process category pages
         if self.context.get('CATEGORY_URL'):
-            urls += self.__process_url_wrapper_elements(self.context.get('categories'))
+            for node in self.statistics.measure_nodes('categories', self.__process_url_wrapper_elements(
+                self.context.get('categories'),
+                newest_by_wrapper,
+                'category'
+            )):
+                yield node
 
         # process tag pages
         if self.context.get('TAG_URL'):
-            urls += self.__process_url_wrapper_elements(sorted(self.context.get('tags'), key=lambda x: x[0].name))
+            with self.statistics.measure('tags'):
+                tags_sorted = sorted(self.context.get('tags'), key=lambda x: x[0].name)
+            for node in self.statistics.measure_nodes('tags', self.__process_url_wrapper_elements(
+                tags_sorted,
+                newest_by_wrapper,
+                'tag'
+            )):
+                yield node
 
         # process author pages
         if self.context.get('AUTHOR_URL'):
-            urls += self.__process_url_wrapper_elements(self.context.get('authors'))
+            for node in self.statistics.measure_nodes('authors', self.__process_url_wrapper_elements(
+                self.context.get('authors'),
+                newest_by_wrapper,
+                'author'
+            )):
+                yield node
 
         # handle all DIRECT_TEMPLATES but "index"
+        for node in self.statistics.measure_nodes(
+            'direct_templates',
+            self.__generate_direct_template_entries(articles_sorted, newest)
+        ):
+            yield node
+
+    def __generate_direct_template_entries(self, articles_sorted, newest):
+        """
+        Generator yielding the entries of all DIRECT_TEMPLATES but "index".
+        :param articles_sorted: the articles sorted by date
+        :type articles_sorted: list
+        :param newest: the newest modification date of all articles
+        :type newest: datetime.datetime | None
+        :returns: generator of (loc, lastmod, content type, extra) entries
+        :rtype: collections.Iterator
+        """
         for direct_template in list(filter(lambda p: p != 'index', self.context.get('DIRECT_TEMPLATES'))):
             # we assume the modification date of the last article as modification date for the listings of
             # categories, authors and archives (all values of DIRECT_TEMPLATES but "index")
             if len(articles_sorted) > 0:
-                modification_time = getattr(articles_sorted[0], 'modified', getattr(articles_sorted[0], 'date', None))
                 url = self.__get_direct_template_url(direct_template)
-                urls += self.__create_url_node_for_content(None, 'others', url, modification_time)
+                per_page = self.__get_per_page(direct_template)
+                if per_page:
+                    name_upper = direct_template.upper()
+                    save_as = self.pelican_settings.get('{}_SAVE_AS'.format(name_upper), '{}.html'.format(direct_template))
+                    entries = self.__generate_listing_entries(
+                        save_as,
+                        self.pelican_settings.get('{}_URL'.format(name_upper), save_as),
+                        self.context['articles'],
+                        per_page,
+                        url,
+                        'others'
+                    )
+                else:
+                    entries = [self.__create_entry(None, 'others', url, newest)]
+                for entry in entries:
+                    if entry is not None:
+                        yield entry
 
-        # write the final sitemap file
-        with codecs_open(os.path.join(self.path_output, 'sitemap.xml'), 'w', encoding='utf-8') as fd:
-            fd.write(self.xml_wrap % {
-                'SITEURL': self.url_site,
-                'urls': urls
-            })
+    def __get_newest_dates(self):
+        """
+        Determines the newest modification date of all articles and of the articles of every category, tag and author
+        in a single pass over the articles.
+        :returns: tuple of the newest date overall and a dict mapping the url wrappers to their newest date
+        :rtype: tuple
+        """
+        newest = None
+        newest_by_wrapper = {}
+        for article in self.context['articles']:
+            date = self.__get_date_key(article)
+            if newest is None or date > newest:
+                newest = date
+            wrappers = [getattr(article, 'category', None)]
+            wrappers.extend(getattr(article, 'tags', None) or [])
+            wrappers.extend(getattr(article, 'authors', None) or [])
+            for wrapper in wrappers:
+                if wrapper is not None and (wrapper not in newest_by_wrapper or date > newest_by_wrapper[wrapper]):
+                    newest_by_wrapper[wrapper] = date
+        return newest, newest_by_wrapper
 
     def __get_direct_template_url(self, name):
         """
@@ -204,29 +1927,144 @@ class SitemapGenerator(object):
                 '{}.html'.format(name)
             )
         )
-        return urljoin(self.url_site, url)
+        return self.renderer.join_url(url)
 
-    def __process_url_wrapper_elements(self, elements):
+    def __process_url_wrapper_elements(self, elements, newest_by_wrapper, template_name):
         """
-        Creates the url nodes for pelican.urlwrappers.Category and pelican.urlwrappers.Tag.
+        Generator yielding the entries for pelican.urlwrappers.Category and pelican.urlwrappers.Tag.
         :param elements: list of wrapper elements
         :type elements: list
-        :return: the processes urls as HTML
-        :rtype: str
+        :param newest_by_wrapper: the newest modification date per url wrapper
+        :type newest_by_wrapper: dict
+        :param template_name: the name of the template of the listings, to determine their pagination
+        :type template_name: str
+        :return: generator of (loc, lastmod, content type, extra) entries
+        :rtype: collections.Iterator
         """
-        urls = ''
+        per_page = self.__get_per_page(template_name)
         for url_wrapper, articles in elements:
-            urls += self.__create_url_node_for_content(
+            if per_page:
+                for entry in self.__generate_listing_entries(
+                    url_wrapper.save_as,
+                    url_wrapper.url,
+                    articles,
+                    per_page,
+                    self.renderer.join_url(url_wrapper.url),
+                    'others'
+                ):
+                    if entry is not None:
+                        yield entry
+                continue
+            modification_time = newest_by_wrapper.get(url_wrapper)
+            if modification_time is None:
+                modification_time = max(self.__get_date_key(article) for article in articles)
+            entry = self.__create_entry(
                 url_wrapper,
                 'others',
-                url=urljoin(self.url_site, url_wrapper.url),
-                modification_time=self.__get_date_key(sorted(articles, key=self.__get_date_key, reverse=True)[0])
+                url=self.renderer.join_url(url_wrapper.url),
+                modification_time=modification_time
             )
-        return urls
+            if entry is not None:
+                yield entry
+
+    def __get_per_page(self, template_name):
+        """
+        Returns the number of articles per page of the listings of the given template, like the pelican writer does.
+        :param template_name: the name of the template
+        :type template_name: str
+        :returns: the number of articles per page or None if the listings are not paginated
+        :rtype: int | None
+        """
+        paginated_templates = self.pelican_settings.get('PAGINATED_TEMPLATES') or {}
+        if template_name not in paginated_templates:
+            return None
+        return paginated_templates[template_name] or self.pelican_settings.get('DEFAULT_PAGINATION') or None
+
+    def __generate_listing_entries(self, save_as, url, articles, per_page, loc_first, content_type_first):
+        """
+        Generator yielding the entries of all pages of a paginated listing.
+        The articles of a page shift to the next page when a newer article is added, so the modification date of a
+        page is the newest date of its articles and of all articles on the pages before it. These prefix maxima are
+        built up in a single pass over the articles in the order of the listing.
+        :param save_as: the output file name of the listing, the base of the page urls
+        :type save_as: str
+        :param url: the url of the listing
+        :type url: str
+        :param articles: the articles of the listing in the order they are listed
+        :type articles: list
+        :param per_page: the number of articles per page
+        :type per_page: int
+        :param loc_first: the absolute url of the first page
+        :type loc_first: str
+        :param content_type_first: the content type of the first page, the other pages are of type "others"
+        :type content_type_first: str
+        :returns: generator of (loc, lastmod, content type, extra) entries, None for excluded urls
+        :rtype: collections.Iterator
+        """
+        count = len(articles)
+        orphans = self.pelican_settings.get('DEFAULT_ORPHANS') or 0
+        # same calculation as pelican.paginator.Paginator
+        num_pages = int(ceil(max(1, count - orphans) / float(per_page)))
+        newest = None
+        index = 0
+        for number in range(1, num_pages + 1):
+            top = number * per_page
+            if top + orphans >= count:
+                top = count
+            while index < top:
+                date = self.__get_date_key(articles[index])
+                if date is not None and (newest is None or date > newest):
+                    newest = date
+                index += 1
+            if number == 1:
+                yield self.__create_entry(None, content_type_first, loc_first, newest)
+            else:
+                loc = self.renderer.join_url(self.__get_page_url(save_as, url, number, num_pages))
+                yield self.__create_entry(None, 'others', loc, newest)
+
+    def __get_page_url(self, save_as, url, number, num_pages):
+        """
+        Returns the url of the given page of a paginated listing from the PAGINATION_PATTERNS, the same way as
+        pelican.paginator.Page does.
+        :param save_as: the output file name of the listing
+        :type save_as: str
+        :param url: the url of the listing
+        :type url: str
+        :param number: the 1-based page number
+        :type number: int
+        :param num_pages: the number of pages
+        :type num_pages: int
+        :rtype: str
+        """
+        rule = None
+        for pattern in self.pelican_settings.get('PAGINATION_PATTERNS') or self.pagination_patterns_default:
+            # pelican settings hold PaginationRule tuples of minimum page, url and save as
+            min_page, pattern_url = pattern[0], pattern[1]
+            if min_page == -1:
+                if number == num_pages:
+                    rule = pattern_url
+                    break
+            elif min_page <= number:
+                rule = pattern_url
+        if not rule:
+            return ''
+        name, extension = os.path.splitext(save_as)
+        path, filename = os.path.split(save_as)
+        page_url = rule.format(
+            save_as=save_as,
+            url=url,
+            name=name,
+            base_name=path if filename in ('index.htm', 'index.html') else name,
+            extension=extension,
+            number=number,
+        )
+        if page_url.startswith('/'):
+            page_url = page_url[1:]
+        return page_url
 
-    def __create_url_node_for_content(self, content, content_type, url=None, modification_time=None):
+    def __create_entry(self, content, content_type, url=None, modification_time=None, extra=None, rules=True):
         """
-        Creates the required <url> node for the sitemap xml.
+        Creates the entry of the url in the sitemap xml.
         :param content: the content class to handle
         :type content: pelican.contents.Content | None
         :param content_type: the type of the given content to match settings.EXTENDED_SITEMAP_PLUGIN
@@ -235,37 +2073,406 @@ class SitemapGenerator(object):
         :type url: str
         :param modification_time: the modification time of the url, will be used instead of content date if given
         :type modification_time: datetime.datetime | None
-        :returns: the text node
-        :rtype: str
+        :param extra: additional child nodes of the url node
+        :type extra: str | None
+        :param rules: whether to apply the rules, False if the caller already did
+        :type rules: bool
+        :returns: tuple of the absolute url, the formatted lastmod value, the content type and the additional nodes or
+            None if the url is excluded
+        :rtype: tuple | None
         """
         loc = url
         if loc is None:
-            loc = urljoin(self.url_site, self.context.get('ARTICLE_URL').format(**content.url_format))
-        lastmod = None
-        if modification_time is not None:
-            lastmod = modification_time.strftime('%Y-%m-%d')
+            loc = self.renderer.join_url(self.context.get('ARTICLE_URL').format(**content.url_format))
+        if rules:
+            content_type = self.__apply_rules(content, content_type, loc)
+            if content_type is None:
+                return None
+        if modification_time is None and content is not None:
+            if self.source_dates is None:
+                modification_time = getattr(content, 'modified', None) or getattr(content, 'date', None) or None
+            else:
+                modification_time = self.__get_date_key(content)
+        lastmod = None if modification_time is None else self.renderer.format_date(modification_time)
+        return loc, lastmod, content_type, extra
+
+    def __apply_rules(self, content, content_type, loc):
+        """
+        Applies the front matter overrides of articles and pages and the configured rules to the given url.
+        :param content: the content of the url
+        :type content: pelican.contents.Content | None
+        :param content_type: the content type
+        :type content_type: str
+        :param loc: the absolute url
+        :type loc: str
+        :returns: the content type, a (content type, change frequency, priority) tuple if the change frequency or the
+            priority is overridden or None if the url is excluded
+        :rtype: str | tuple | None
+        """
+        overrides = {}
+        if content_type == 'articles' or content_type == 'pages':
+            metadata = getattr(content, 'metadata', None)
+            if metadata:
+                if 'sitemap_exclude' in metadata:
+                    overrides['exclude'] = '{}'.format(metadata['sitemap_exclude']).lower() in ('true', 'yes', '1')
+                if 'sitemap_priority' in metadata:
+                    priority = parse_priority(metadata['sitemap_priority'])
+                    if priority is None:
+                        logger.warning(
+                            'extended_sitemap: ignoring the sitemap_priority %r of %s, it must be between 0.0 and 1.0',
+                            metadata['sitemap_priority'],
+                            getattr(content, 'source_path', content)
+                        )
+                    else:
+                        overrides['priority'] = priority
+                if 'sitemap_changefreq' in metadata:
+                    changefreq = '{}'.format(metadata['sitemap_changefreq']).strip().lower()
+                    if changefreq in _changefrequencies:
+                        overrides['changefreq'] = changefreq
+                    else:
+                        logger.warning(
+                            'extended_sitemap: ignoring the sitemap_changefreq %r of %s, it must be one of %s',
+                            metadata['sitemap_changefreq'],
+                            getattr(content, 'source_path', content),
+                            ', '.join(_changefrequencies)
+                        )
+        if self.rules is not None and len(overrides) < 3:
+            category = getattr(content, 'category', None) if content_type == 'articles' else None
+            url = loc[len(self.url_site):] if loc.startswith(self.url_site) else loc
+            rule = self.rules.match(url, None if category is None else '{}'.format(category))
+            if rule is not None:
+                for key in ('exclude', 'priority', 'changefreq'):
+                    if key in rule and key not in overrides:
+                        overrides[key] = rule[key]
+        if not overrides:
+            return content_type
+        if overrides.get('exclude'):
+            return None
+        changefreq = overrides.get('changefreq', self.settings.get('changefrequencies')[content_type])
+        priority = overrides.get('priority', self.settings.get('priorities')[content_type])
+        if changefreq == self.settings.get('changefrequencies')[content_type] and \
+                priority == self.settings.get('priorities')[content_type]:
+            return content_type
+        return content_type, changefreq, priority
+
+    def __render_entries(self, entries):
+        """
+        Renders the <url> nodes of the given entries.
+        :param entries: iterable of (loc, lastmod, content type, extra) entries
+        :type entries: collections.Iterable
+        :returns: generator of (url node text, lastmod) tuples in the order of the entries
+        :rtype: collections.Iterator
+        """
+        if self.validator is not None:
+            entries = self.__validate_entries(entries)
+        if self.entries is not None:
+            entries = self.__collect_entries(entries)
+        return self.statistics.measure_nodes('render', self.__render_nodes(entries), count=False)
+
+    def __render_nodes(self, entries):
+        render = self.renderer.render
+        for loc, lastmod, content_type, extra in entries:
+            yield render(loc, lastmod, content_type, extra), lastmod
+
+    def __get_date_key(self, obj):
+        """
+        Returns the modification date of the given content: the modified metadata, the date of the configured lastmod
+        source or the date metadata.
+        :param obj: the content
+        :type obj: pelican.contents.Content
+        :rtype: datetime.datetime | None
+        """
+        modified = getattr(obj, 'modified', None)
+        if modified:
+            return modified
+        if self.source_dates is not None:
+            date = self.source_dates.get(getattr(obj, 'source_path', None))
+            if date is not None:
+                return date
+        return getattr(obj, 'date', None) or None
+
+    def __get_source_dates(self):
+        """
+        Returns the modification dates of the source files of all articles and pages, their translations included,
+        from the configured lastmod source.
+        :returns: dict mapping the source paths to timezone aware dates
+        :rtype: dict
+        """
+        paths = set()
+        for content_type in ('articles', 'pages'):
+            for content in self.context.get(content_type):
+                for member in [content] + list(getattr(content, 'translations', None) or []):
+                    path = getattr(member, 'source_path', None)
+                    if path:
+                        paths.add(path)
+
+        if self.settings.get('lastmod_source') == 'git':
+            timestamps = self.__get_git_timestamps()
+            paths_timestamps = (
+                (path, timestamps.get(os.path.relpath(path, self.path_content).replace(os.sep, '/'))) for path in paths
+            )
         else:
-            if content is not None:
-                if getattr(content, 'modified', None) is not None:
-                    lastmod = getattr(content, 'modified').strftime('%Y-%m-%d')
-                elif getattr(content, 'date', None) is not None:
-                    lastmod = getattr(content, 'date').strftime('%Y-%m-%d')
+            paths_timestamps = ((path, os.path.getmtime(path) if os.path.exists(path) else None) for path in paths)
 
-        output = "<loc>{}</loc>".format(loc)
-        if lastmod is not None:
-            output += "\n<lastmod>{}</lastmod>".format(lastmod)
-        output += "\n<changefreq>{}</changefreq>".format(self.settings.get('changefrequencies').get(content_type))
-        output += "\n<priority>{:.2f}</priority>".format(self.settings.get('priorities').get(content_type))
+        return dict(
+            (path, datetime.fromtimestamp(timestamp, self.timezone))
+            for path, timestamp in paths_timestamps if timestamp is not None
+        )
 
-        return self.template_url.format(output)
+    def __get_git_timestamps(self):
+        """
+        Returns the time of the last commit of every file in the content dir, determined by a single git log run.
+        The result is cached by the HEAD commit, so git log only runs again if there is a new commit.
+        :returns: dict mapping the paths relative to the content dir to unix timestamps
+        :rtype: dict
+        """
+        try:
+            head = subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], cwd=self.path_content, stderr=subprocess.STDOUT
+            ).decode('utf-8').strip()
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.warning('extended_sitemap: cannot determine the git HEAD of %s, no git lastmod (%s)', self.path_content, e)
+            return {}
 
-    @staticmethod
-    def __get_date_key(obj):
-        return getattr(obj, 'modified', None) or obj.date
+        cache = self.__load_cache('extended_sitemap_git', {'head': None, 'path': None, 'timestamps': {}})
+        if cache.get('head') == head and cache.get('path') == self.path_content:
+            return cache.get('timestamps')
 
-    @staticmethod
-    def __get_title_key(obj):
-        return getattr(obj, 'title')
+        # the commits are listed newest first, the first commit listing a file is its last change
+        try:
+            output = subprocess.check_output(
+                ['git', '-c', 'core.quotepath=off', 'log', '--name-only', '--relative', '--format=%x00%ct', '--', '.'],
+                cwd=self.path_content
+            ).decode('utf-8')
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.warning('extended_sitemap: cannot read the git log of %s, no git lastmod (%s)', self.path_content, e)
+            return {}
+        timestamps = {}
+        for commit in output.split('\x00')[1:]:
+            lines = commit.splitlines()
+            timestamp = int(lines[0])
+            for filename in lines[1:]:
+                if filename and filename not in timestamps:
+                    timestamps[filename] = timestamp
+
+        self.__save_cache('extended_sitemap_git', {'head': head, 'path': self.path_content, 'timestamps': timestamps})
+        return timestamps
+
+
+def get_file_digest(path):
+    """
+    Returns the sha1 digest of the given file, read in chunks.
+    :param path: the path of the file
+    :type path: str
+    :rtype: bytes
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(65536), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def get_zone_name(tzinfo):
+    """
+    Returns the name of the given pytz or zoneinfo timezone.
+    :param tzinfo: the timezone
+    :type tzinfo: datetime.tzinfo | None
+    :returns: the name or None for other timezones like fixed offsets
+    :rtype: str | None
+    """
+    return getattr(tzinfo, 'zone', None) or getattr(tzinfo, 'key', None)
+
+
+def format_utc_offset(offset):
+    """
+    Formats the given utc offset as W3C time zone designator.
+    :param offset: the utc offset
+    :type offset: datetime.timedelta | None
+    :returns: the designator like "+02:00", an empty string for a missing offset
+    :rtype: str
+    """
+    if offset is None:
+        return ''
+    minutes = int(offset.total_seconds()) // 60
+    return '{}{:02d}:{:02d}'.format('-' if minutes < 0 else '+', abs(minutes) // 60, abs(minutes) % 60)
+
+
+def parse_priority(value):
+    """
+    Converts the given priority of a rule or the front matter into a float.
+    :param value: the priority
+    :type value: float | str
+    :returns: the priority or None if it is not a number between 0.0 and 1.0
+    :rtype: float | None
+    """
+    try:
+        priority = float(value)
+    except (TypeError, ValueError):
+        return None
+    # also false for nan
+    if not 0.0 <= priority <= 1.0:
+        return None
+    return priority
+
+
+def quote_uri(text):
+    """
+    Percent-encodes all characters of the given url part that are not allowed in an URI, non-ASCII characters as UTF-8.
+    Existing escapes and the reserved characters are kept, a "%" not starting an escape is encoded.
+    :param text: the url part
+    :type text: str
+    :rtype: str
+    """
+    return quote(_re_bare_percent.sub('%25', text).encode('utf-8'), safe=_uri_safe_chars)
+
+
+def iri_to_uri(iri):
+    """
+    Converts the given IRI into an URI: the host name is IDNA encoded, the other parts are percent-encoded.
+    Urls that are valid URIs already are returned as they are after a single regex search.
+    :param iri: the absolute or relative url, possibly with non-ASCII characters
+    :type iri: str
+    :rtype: str
+    """
+    if _re_uri_unsafe.search(iri) is None:
+        return iri
+    scheme, netloc, path, query, fragment = urlsplit(iri)
+    if _re_uri_unsafe.search(netloc) is not None:
+        try:
+            netloc = netloc.encode('idna').decode('ascii')
+        except UnicodeError:
+            netloc = quote_uri(netloc)
+    return urlunsplit((scheme, netloc, quote_uri(path), quote_uri(query), quote_uri(fragment)))
+
+
+def sort_content(contents):
+    """
+    Sorts the given articles, pages or other contents in a single pass over them.
+    Contents with a modified or date value come first, sorted by it in descending order, followed by the contents
+    without any date sorted by title. Every content ends up in exactly one of the two groups. The groups are sorted in
+    place by key functions, so no additional object is allocated per content.
+    :param contents: the contents to sort
+    :type contents: collections.Iterable
+    :returns: the sorted contents
+    :rtype: list
+    """
+    with_date = []
+    without_date = []
+    for content in contents:
+        if get_sort_date(content):
+            with_date.append(content)
+        else:
+            without_date.append(content)
+    with_date.sort(key=get_sort_date, reverse=True)
+    without_date.sort(key=attrgetter('title'))
+    with_date.extend(without_date)
+    return with_date
+
+
+def get_sort_date(content):
+    """
+    Returns the date the given content is sorted by.
+    :param content: the content
+    :type content: pelican.contents.Content
+    :rtype: datetime.datetime | None
+    """
+    return getattr(content, 'modified', None) or getattr(content, 'date', None)
+
+
+def create_sitemap_generator(settings, context=None):
+    """
+    Creates the SitemapGenerator for the given settings outside of a Pelican build.
+    :param settings: the pelican settings
+    :type settings: dict
+    :param context: the context of the build, if None a context without any content is used, e.g. to write the sitemap
+        from the snapshot
+    :type context: dict | None
+    :rtype: SitemapGenerator
+    """
+    if context is None:
+        context = settings.copy()
+        context.update({'articles': [], 'pages': [], 'categories': [], 'tags': [], 'authors': []})
+    return SitemapGenerator(context, settings, settings.get('PATH'), settings.get('THEME'), settings.get('OUTPUT_PATH'))
+
+
+def generate_sitemaps(sites, workers=None, processes=False, index_path=None):
+    """
+    Generates the sitemaps of many sites in a thread or process pool. The sites share the renderers, the formatted
+    dates and the stylesheet templates of the process.
+    :param sites: list of (settings, context) tuples of the sites, the pelican settings and the context of the build or
+        None to write the sitemap from the snapshot of the last build
+    :type sites: list
+    :param workers: the number of threads or processes, the sites are generated serially if not set
+    :type workers: int | None
+    :param processes: whether to use a process pool instead of a thread pool, the contexts have to be picklable then
+    :type processes: bool
+    :param index_path: if set, a sitemap index referencing the sitemap files of all sites is written into this file
+    :type index_path: str | None
+    :returns: the report with the urls per site and the total throughput
+    :rtype: collections.OrderedDict
+    :raises ConfigurationError: if there is no usable snapshot for a site without context
+    """
+    timer = SitemapStatistics.timer
+    time_start = timer()
+    if workers and workers > 1 and ThreadPoolExecutor is not None:
+        executor = (ProcessPoolExecutor if processes else ThreadPoolExecutor)(max_workers=workers)
+        try:
+            results = list(executor.map(_generate_site, *zip(*sites)))
+        finally:
+            executor.shutdown()
+    else:
+        results = [_generate_site(settings, context) for settings, context in sites]
+
+    if index_path is not None:
+        head, foot = SitemapGenerator.xml_wrap_index.split('%(sitemaps)s')
+        with SitemapFile(index_path) as fd:
+            fd.write(head)
+            for url_site, sitemaps, duration in results:
+                for loc, lastmod, count in sitemaps:
+                    fd.write(SitemapGenerator.render_sitemap(loc, lastmod))
+            fd.write(foot)
+
+    total_time = timer() - time_start
+    total_urls = sum(count for url_site, sitemaps, duration in results for loc, lastmod, count in sitemaps)
+    report = OrderedDict([
+        ('sites', [
+            OrderedDict([
+                ('url', url_site),
+                ('urls', sum(count for loc, lastmod, count in sitemaps)),
+                ('time', round(duration, 6)),
+            ]) for url_site, sitemaps, duration in results
+        ]),
+        ('total_urls', total_urls),
+        ('total_time', round(total_time, 6)),
+        ('urls_per_second', round(total_urls / total_time, 1) if total_time else None),
+    ])
+    logger.info(
+        'extended_sitemap: %d urls of %d sites written in %.3fs (%s urls/s)',
+        total_urls,
+        len(results),
+        total_time,
+        report['urls_per_second']
+    )
+    return report
+
+
+def _generate_site(settings, context):
+    """
+    Generates the sitemap of a site of a batch, also within a pool worker.
+    :param settings: the pelican settings
+    :type settings: dict
+    :param context: the context of the build or None to use the snapshot
+    :type context: dict | None
+    :returns: tuple of the site url, the written sitemap files and the time taken
+    :rtype: tuple
+    """
+    time_start = SitemapStatistics.timer()
+    generator = create_sitemap_generator(settings, context)
+    if context is None and not generator.load_snapshot():
+        raise ConfigurationError('There is no usable snapshot for the site {}!'.format(generator.url_site))
+    generator.generate_output(None)
+    return generator.url_site, generator.sitemaps, SitemapStatistics.timer() - time_start
 
 
 def get_generators(generators):
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Rebuilds the sitemap files and the stylesheet without a Pelican build.
+
+The urls are taken from the snapshot saved by the last build with the ``snapshot`` setting or from the html files in
+the output dir. Changed priorities, change frequencies, sharding and output options of the settings are applied.
+
+Usage::
+
+    python -m extended_sitemap -s pelicanconf.py
+    python -m extended_sitemap -s pelicanconf.py --source scan
+"""
+from __future__ import unicode_literals, print_function
+
+import argparse
+import json
+import logging
+import sys
+import time
+
+from pelican.settings import read_settings
+
+from extended_sitemap import create_sitemap_generator
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rebuilds the extended_sitemap sitemap files without a Pelican build.')
+    parser.add_argument('-s', '--settings', default=None, help='the pelican settings file, e.g. pelicanconf.py')
+    parser.add_argument('-o', '--output', default=None, help='the output dir, overrides OUTPUT_PATH')
+    parser.add_argument(
+        '--source',
+        choices=['snapshot', 'scan'],
+        default='snapshot',
+        help='read the urls from the snapshot of the last build or from the html files of the output dir, except '
+             'the drafts and theme dirs, use rules to exclude other unlisted files like error pages'
+    )
+    parser.add_argument(
+        '--plugin-settings',
+        type=json.loads,
+        default=None,
+        help='EXTENDED_SITEMAP_PLUGIN settings as JSON, merged into the ones of the settings file'
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+
+    override = {}
+    if args.output is not None:
+        override['OUTPUT_PATH'] = args.output
+    settings = read_settings(args.settings, override=override)
+    if args.plugin_settings is not None:
+        plugin_settings = dict(settings.get('EXTENDED_SITEMAP_PLUGIN', {}))
+        plugin_settings.update(args.plugin_settings)
+        settings['EXTENDED_SITEMAP_PLUGIN'] = plugin_settings
+
+    time_start = time.time()
+    generator = create_sitemap_generator(settings)
+    if args.source == 'scan':
+        generator.scan_output()
+    elif not generator.load_snapshot():
+        print('There is no usable snapshot, enable the snapshot setting and build the site once.', file=sys.stderr)
+        return 1
+    generator.generate_output(None)
+
+    count = sum(len(entries) for name, entries in generator.sections)
+    print(
+        'Wrote the sitemap with {} urls to {} in {:.3f}s'.format(count, settings.get('OUTPUT_PATH'), time.time() - time_start),
+        file=sys.stderr
+    )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,14 +2,24 @@
 from __future__ import unicode_literals, print_function
 
 import filecmp
+import gzip
+import json
 import locale
 import os
 import re
+import shutil
 import subprocess
 import sys
 import unittest
 
-from extended_sitemap import ConfigurationError
+from extended_sitemap import (
+    ConfigurationError, SitemapRenderer, SitemapRules, SitemapValidator, generate_sitemaps, iri_to_uri,
+    sitemap_generated, sort_content
+)
+from extended_sitemap.__main__ import main as cli_main
+from extended_sitemap.tests.benchmark import FakeContent, create_context, create_generator
+
+from datetime import datetime, timedelta
 
 from functools import wraps
 
@@ -18,6 +28,8 @@ from tempfile import mkdtemp
 from pelican import Pelican
 from pelican.settings import read_settings
 
+from pytz import FixedOffset, timezone, utc
+
 from six import StringIO
 
 # used paths
@@ -129,6 +141,216 @@ class FileComparisonTest(unittest.TestCase):
             self.fail(msg_fail)
 
 
+class SortContentTest(unittest.TestCase):
+
+    def test_sort_content(self):
+        """
+        Tests that contents with date are sorted by date, followed by the contents without date sorted by title.
+        A content with a falsy but not None date must not get lost (it did with the former two filter passes).
+        """
+        newer = FakeContent('Newer', 'newer.html', date=datetime(2014, 1, 1), modified=datetime(2015, 1, 1))
+        older = FakeContent('Older', 'older.html', date=datetime(2014, 6, 1))
+        empty_date = FakeContent('B', 'b.html', date='')
+        no_date = FakeContent('A', 'a.html')
+        self.assertEqual(sort_content([empty_date, older, no_date, newer]), [newer, older, no_date, empty_date])
+
+
+class SitemapRulesTest(unittest.TestCase):
+
+    def test_match(self):
+        """
+        Tests that the first matching rule wins, across url patterns and categories, and that the hits are counted.
+        """
+        rules = SitemapRules([
+            {'pattern': 'blog/*.html', 'priority': 0.1},
+            {'category': 'news', 'priority': 0.2},
+            {'regex': r'blog/news-', 'priority': 0.3},
+            {'pattern': 'page-?.html', 'exclude': True},
+        ])
+        self.assertEqual(rules.match('blog/news-1.html', 'news')['priority'], 0.1)
+        self.assertEqual(rules.match('news-1.html', 'news')['priority'], 0.2)
+        self.assertEqual(rules.match('blog/news-1.xml')['priority'], 0.3)
+        self.assertTrue(rules.match('page-1.html')['exclude'])
+        self.assertIsNone(rules.match('page-10.html'))
+        self.assertIsNone(rules.match('other/blog/a.html', 'other'))
+        self.assertEqual(rules.hits, [1, 1, 1, 1])
+
+    def test_metadata(self):
+        """
+        Tests that the front matter of articles and pages takes precedence over the rules.
+        """
+        generator = create_generator({}, mkdtemp(prefix='extended_sitemap_tests.'), {
+            'rules': [{'pattern': '*', 'priority': 0.1, 'changefreq': 'never'}],
+        })
+        apply_rules = generator._SitemapGenerator__apply_rules
+        content = FakeContent('Article', 'article.html')
+        content.metadata = {'sitemap_priority': '0.6'}
+        self.assertEqual(apply_rules(content, 'articles', 'http://example.com/article.html'), ('articles', 'never', 0.6))
+        content.metadata = {'sitemap_priority': '0.8', 'sitemap_changefreq': 'weekly'}
+        self.assertEqual(apply_rules(content, 'articles', 'http://example.com/article.html'), 'articles')
+        content.metadata = {'sitemap_exclude': 'True'}
+        self.assertIsNone(apply_rules(content, 'pages', 'http://example.com/article.html'))
+        # the front matter of the article the index date is taken from does not apply to the index
+        self.assertEqual(apply_rules(content, 'index', 'http://example.com/'), ('index', 'never', 0.1))
+        # invalid front matter values are ignored
+        content.metadata = {'sitemap_priority': 'high', 'sitemap_changefreq': 'Weekly'}
+        self.assertEqual(apply_rules(content, 'articles', 'http://example.com/article.html'), ('articles', 'weekly', 0.1))
+        content.metadata = {'sitemap_priority': '2', 'sitemap_changefreq': 'sometimes'}
+        self.assertEqual(apply_rules(content, 'articles', 'http://example.com/article.html'), ('articles', 'never', 0.1))
+
+    def test_invalid(self):
+        """
+        Tests that invalid rules raise a ConfigurationError and that regexes which cannot be joined still match.
+        """
+        self.assertRaises(ConfigurationError, SitemapRules, [{'priority': 0.1}])
+        self.assertRaises(ConfigurationError, SitemapRules, [{'pattern': '*', 'category': 'news', 'priority': 0.1}])
+        self.assertRaises(ConfigurationError, SitemapRules, [{'pattern': '*'}])
+        self.assertRaises(ConfigurationError, SitemapRules, [{'regex': '(', 'priority': 0.1}])
+        self.assertRaises(ConfigurationError, SitemapRules, [{'pattern': '*', 'priority': 'high'}])
+        self.assertRaises(ConfigurationError, SitemapRules, [{'pattern': '*', 'priority': 1.5}])
+        self.assertRaises(ConfigurationError, SitemapRules, [{'pattern': '*', 'changefreq': 'sometimes'}])
+        self.assertEqual(SitemapRules([{'pattern': '*', 'priority': '0.5'}]).match('a.html')['priority'], 0.5)
+        rules = SitemapRules([
+            {'pattern': 'tag/*', 'exclude': True},
+            {'regex': '(?i)blog/', 'priority': 0.1},
+            {'regex': r'(?P<a>x)-', 'priority': 0.2},
+            {'regex': r'(?P<a>y)-', 'priority': 0.3},
+            {'regex': r'(a)\1', 'priority': 0.4},
+        ])
+        self.assertIsNone(rules.matcher)
+        self.assertTrue(rules.match('tag/a.html')['exclude'])
+        self.assertEqual(rules.match('Blog/a.html')['priority'], 0.1)
+        self.assertEqual(rules.match('x-1.html')['priority'], 0.2)
+        self.assertEqual(rules.match('y-1.html')['priority'], 0.3)
+        self.assertEqual(rules.match('aa.html')['priority'], 0.4)
+        self.assertIsNone(rules.match('ab.html'))
+
+
+class SitemapUrlTest(unittest.TestCase):
+
+    def test_iri_to_uri(self):
+        """
+        Tests that non-ASCII characters, spaces and bare "%" are percent-encoded, non-ASCII hosts IDNA encoded and valid
+        URIs kept.
+        """
+        self.assertEqual(iri_to_uri('http://example.com/a.html?b=1&c=%20'), 'http://example.com/a.html?b=1&c=%20')
+        self.assertEqual(
+            iri_to_uri('http://exämple.com/über uns.html?q=ä#ö'),
+            'http://xn--exmple-cua.com/%C3%BCber%20uns.html?q=%C3%A4#%C3%B6'
+        )
+        self.assertEqual(iri_to_uri('http://example.com/ä 100%'), 'http://example.com/%C3%A4%20100%25')
+        self.assertEqual(iri_to_uri('http://example.com/100%-sale.html'), 'http://example.com/100%25-sale.html')
+        renderer = SitemapRenderer('http://example.com/', '<url>{}</url>', {}, {})
+        self.assertEqual(renderer.join_url('100%-sale.html'), 'http://example.com/100%25-sale.html')
+        self.assertEqual(renderer.join_url('100%25-sale.html'), 'http://example.com/100%25-sale.html')
+
+    def test_render(self):
+        """
+        Tests that the relative urls are encoded when joined, that the locs are xml escaped when rendered and that only
+        rule overrides are compiled on first use.
+        """
+        renderer = SitemapRenderer('http://example.com/', '<url>{}</url>', {'pages': 'daily'}, {'pages': 0.5})
+        self.assertEqual(renderer.join_url('pages/über.html'), 'http://example.com/pages/%C3%BCber.html')
+        loc = renderer.join_url('search.html?a=1&b=2')
+        self.assertEqual(loc, 'http://example.com/search.html?a=1&b=2')
+        self.assertIn('<loc>http://example.com/search.html?a=1&amp;b=2</loc>', renderer.render(loc, None, 'pages'))
+        self.assertIn('<priority>0.10</priority>', renderer.render(loc, None, ('pages', 'daily', 0.1)))
+        self.assertRaises(ConfigurationError, renderer.render, loc, None, 'articles')
+
+    def test_validate(self):
+        """
+        Tests the detection of duplicate, external and too long urls.
+        """
+        validator = SitemapValidator('http://example.com/')
+        self.assertTrue(validator.validate('http://example.com/a.html'))
+        self.assertFalse(validator.validate('http://example.com/a.html'))
+        self.assertFalse(validator.validate('http://example.org/a.html'))
+        self.assertFalse(validator.validate('http://example.com/' + 'a' * 2048))
+        self.assertEqual((validator.duplicates, validator.external, validator.too_long), (1, 1, 1))
+
+
+class FormatDateTest(unittest.TestCase):
+
+    def test_format_date(self):
+        """
+        Tests that the lastmod values are normalized to the configured timezone with date and datetime precision.
+        """
+        tz = timezone('Europe/Berlin')
+        renderer_date = SitemapRenderer('http://example.com/', '<url>{}</url>', {}, {}, tz)
+        renderer_datetime = SitemapRenderer('http://example.com/', '<url>{}</url>', {}, {}, tz, 'datetime')
+        late_utc = utc.localize(datetime(2014, 6, 1, 23, 30))
+        self.assertEqual(renderer_date.format_date(late_utc), '2014-06-02')
+        self.assertEqual(renderer_datetime.format_date(late_utc), '2014-06-02T01:30:00+02:00')
+        self.assertEqual(
+            renderer_datetime.format_date(tz.localize(datetime(2014, 1, 1, 12, 0, 5))),
+            '2014-01-01T12:00:05+01:00'
+        )
+        self.assertEqual(renderer_datetime.format_date(datetime(2014, 1, 1, 12, 0)), '2014-01-01T12:00:00+01:00')
+        self.assertEqual(
+            renderer_datetime.format_date(FixedOffset(-330).localize(datetime(2014, 1, 1, 12, 0))),
+            '2014-01-01T18:30:00+01:00'
+        )
+        renderer_negative = SitemapRenderer(
+            'http://example.com/', '<url>{}</url>', {}, {}, timezone('America/St_Johns'), 'datetime'
+        )
+        self.assertEqual(
+            renderer_negative.format_date(utc.localize(datetime(2014, 1, 1, 12, 0)) + timedelta(minutes=1)),
+            '2014-01-01T08:31:00-03:30'
+        )
+
+
+class GenerateSitemapsTest(unittest.TestCase):
+
+    def test_generate_sitemaps(self):
+        """
+        Tests that the sitemaps of all sites are written in the pool and referenced by the combined sitemap index.
+        """
+        path_temp = mkdtemp(prefix='extended_sitemap_tests.')
+        sites = []
+        for number, plugin_settings in enumerate([{}, {'sharding': True, 'shard_max_urls': 50}]):
+            path_output = os.path.join(path_temp, 'site{}'.format(number))
+            os.makedirs(path_output)
+            settings = {
+                'TIMEZONE': 'Europe/Berlin',
+                'SITEURL': 'http://site{}.example.com'.format(number),
+                'OUTPUT_PATH': path_output,
+                'CACHE_PATH': os.path.join(path_output, 'cache'),
+                'EXTENDED_SITEMAP_PLUGIN': plugin_settings,
+            }
+            sites.append((settings, create_context(100)))
+        path_index = os.path.join(path_temp, 'sitemap.xml')
+
+        report = generate_sitemaps(sites, workers=2, index_path=path_index)
+        shards = sorted(
+            filename for filename in os.listdir(os.path.join(path_temp, 'site1')) if re.match(r'sitemap-.*\.xml$', filename)
+        )
+        with open(path_index) as fd:
+            locs = re.findall(r'<loc>(.*?)</loc>', fd.read())
+        shutil.rmtree(path_temp)
+        self.assertEqual([site['url'] for site in report['sites']], ['http://site0.example.com/', 'http://site1.example.com/'])
+        self.assertEqual(report['sites'][0]['urls'], report['sites'][1]['urls'])
+        self.assertEqual(report['total_urls'], 2 * report['sites'][0]['urls'])
+        # the shards are referenced directly, as a sitemap index must not reference another sitemap index
+        self.assertEqual(
+            sorted(locs),
+            ['http://site0.example.com/sitemap.xml'] + ['http://site1.example.com/' + filename for filename in shards]
+        )
+
+    def test_generate_sitemaps_without_snapshot(self):
+        """
+        Tests that a site without context and without snapshot raises a ConfigurationError.
+        """
+        path_output = mkdtemp(prefix='extended_sitemap_tests.')
+        settings = {
+            'TIMEZONE': 'Europe/Berlin',
+            'SITEURL': 'http://example.com',
+            'OUTPUT_PATH': path_output,
+            'CACHE_PATH': os.path.join(path_output, 'cache'),
+        }
+        self.assertRaises(ConfigurationError, generate_sitemaps, [(settings, None)])
+        shutil.rmtree(path_output)
+
+
 class ExtendedSitemapTest(FileComparisonTest):
 
     def setUp(self):
@@ -262,3 +484,564 @@ class ExtendedSitemapTest(FileComparisonTest):
             os.path.join(EXPECTED_DIR, 'test_sitemap_structure_direct_templates_2.xml'),
             os.path.join(self.path_temp, 'sitemap.xml')
         )
+
+    def test_sitemap_sharding(self):
+        """
+        Tests the sitemap index and shard files if sharding is enabled.
+        """
+        self.__execute_pelican(
+            settings_override={
+                'TIMEZONE': 'Europe/Berlin',
+                'EXTENDED_SITEMAP_PLUGIN': {
+                    'sharding': True,
+                    'shard_max_urls': 10,
+                },
+            }
+        )
+        self.assertFileContentEquals(
+            os.path.join(EXPECTED_DIR, 'test_sitemap_sharding.xml'),
+            os.path.join(self.path_temp, 'sitemap.xml')
+        )
+        self.assertFileContentEquals(
+            os.path.join(EXPECTED_DIR, 'test_sitemap_sharding_taxonomies_2.xml'),
+            os.path.join(self.path_temp, 'sitemap-taxonomies-2.xml')
+        )
+        self.assertFalse(os.path.exists(os.path.join(self.path_temp, 'sitemap-taxonomies-3.xml')))
+
+    def test_sitemap_sharding_unchanged_shards_kept(self):
+        """
+        Tests that shard files with unchanged content are not rewritten by a subsequent build.
+        """
+        settings_override = {
+            'TIMEZONE': 'Europe/Berlin',
+            'EXTENDED_SITEMAP_PLUGIN': {
+                'sharding': True,
+            },
+        }
+        self.__execute_pelican(settings_override=settings_override)
+        path_shard = os.path.join(self.path_temp, 'sitemap-articles-1.xml')
+        os.utime(path_shard, (0, 0))
+        self.__execute_pelican(settings_override=settings_override)
+        self.assertEqual(os.path.getmtime(path_shard), 0)
+
+    def test_sitemap_sharding_error(self):
+        """
+        Tests that no temporary shard file is left in the output dir if rendering the nodes fails.
+        """
+        generator = create_generator({}, self.path_temp, {'sharding': True})
+
+        def nodes():
+            yield '<url><loc>http://example.com/</loc></url>', None
+            raise ValueError('rendering failed')
+
+        self.assertRaises(ValueError, generator._SitemapGenerator__write_shards, 'pages', nodes())
+        self.assertEqual(os.listdir(self.path_temp), [])
+
+    def test_sitemap_unchanged_files_kept(self):
+        """
+        Tests that the sitemap and the stylesheet are only replaced if their content changed.
+        """
+        settings_override = {'TIMEZONE': 'Europe/Berlin'}
+        self.__execute_pelican(settings_override=settings_override)
+        path_sitemap = os.path.join(self.path_temp, 'sitemap.xml')
+        path_stylesheet = os.path.join(self.path_temp, 'sitemap-stylesheet.xsl')
+        os.utime(path_sitemap, (0, 0))
+        os.utime(path_stylesheet, (0, 0))
+
+        self.__execute_pelican(settings_override=settings_override)
+        self.assertEqual(os.path.getmtime(path_sitemap), 0)
+        self.assertEqual(os.path.getmtime(path_stylesheet), 0)
+        self.assertFalse([filename for filename in os.listdir(self.path_temp) if filename.endswith('.tmp')])
+
+        settings_override['SITENAME'] = 'Changed'
+        self.__execute_pelican(settings_override=settings_override)
+        self.assertEqual(os.path.getmtime(path_sitemap), 0)
+        self.assertNotEqual(os.path.getmtime(path_stylesheet), 0)
+
+    def test_sitemap_stylesheet_override(self):
+        """
+        Tests that a stylesheet template of the theme takes precedence and that the values are xml escaped.
+        """
+        path_templates = mkdtemp(prefix='extended_sitemap_templates.')
+        with open(os.path.join(path_templates, 'sitemap-stylesheet.xsl'), 'w') as fd:
+            fd.write('<title>{{ SITENAME }}</title>{% if SITEURL %}<p>{{ SITEURL }}</p>{% endif %}')
+        self.__execute_pelican(
+            settings_override={
+                'TIMEZONE': 'Europe/Berlin',
+                'SITENAME': 'Tom & Jerry',
+                'THEME_TEMPLATES_OVERRIDES': [path_templates],
+            }
+        )
+        shutil.rmtree(path_templates)
+        with open(os.path.join(self.path_temp, 'sitemap-stylesheet.xsl')) as fd:
+            self.assertEqual(fd.read(), '<title>Tom &amp; Jerry</title><p>http://example.com</p>')
+
+    def test_sitemap_stylesheet_disabled(self):
+        """
+        Tests that the stylesheet is neither written nor referenced if disabled and only referenced if external.
+        """
+        self.__execute_pelican(
+            settings_override={
+                'TIMEZONE': 'Europe/Berlin',
+                'EXTENDED_SITEMAP_PLUGIN': {
+                    'stylesheet': False,
+                },
+            }
+        )
+        self.assertFalse(os.path.exists(os.path.join(self.path_temp, 'sitemap-stylesheet.xsl')))
+        with open(os.path.join(self.path_temp, 'sitemap.xml')) as fd:
+            self.assertEqual(fd.readline(), '<?xml version="1.0" encoding="UTF-8"?>\n')
+
+        self.__execute_pelican(
+            settings_override={
+                'TIMEZONE': 'Europe/Berlin',
+                'EXTENDED_SITEMAP_PLUGIN': {
+                    'stylesheet': 'https://static.example.com/sitemap.xsl',
+                },
+            }
+        )
+        self.assertFalse(os.path.exists(os.path.join(self.path_temp, 'sitemap-stylesheet.xsl')))
+        with open(os.path.join(self.path_temp, 'sitemap.xml')) as fd:
+            self.assertEqual(
+                fd.readline(),
+                '<?xml version="1.0" encoding="UTF-8"?>'
+                '<?xml-stylesheet type="text/xsl" href="https://static.example.com/sitemap.xsl"?>\n'
+            )
+
+    def test_sitemap_entries(self):
+        """
+        Tests that the entries are sent with the sitemap_generated signal, also if an incremental build is skipped.
+        """
+        received = []
+
+        def receiver(sender, entries):
+            received.append(entries)
+
+        settings_override = {
+            'TIMEZONE': 'Europe/Berlin',
+            'EXTENDED_SITEMAP_PLUGIN': {
+                'incremental': True,
+            },
+        }
+        sitemap_generated.connect(receiver)
+        try:
+            self.__execute_pelican(settings_override=settings_override)
+            self.__execute_pelican(settings_override=settings_override)
+        finally:
+            sitemap_generated.disconnect(receiver)
+
+        self.assertEqual(len(received), 2)
+        with open(os.path.join(self.path_temp, 'sitemap.xml')) as fd:
+            locs = re.findall(r'<loc>(.*?)</loc>', fd.read())
+        for entries in received:
+            self.assertEqual([entry.loc for entry in entries], locs)
+        entry = received[0][0]
+        self.assertEqual(
+            (entry.loc, entry.changefreq, entry.priority, entry.type),
+            ('http://example.com/', 'daily', 1.0, 'index')
+        )
+        self.assertEqual([(entry.loc, entry.lastmod) for entry in received[0]], [(entry.loc, entry.lastmod) for entry in received[1]])
+
+    def test_sitemap_changes(self):
+        """
+        Tests the changes file listing the urls added, updated and removed since the previous build.
+        """
+        settings_override = {
+            'TIMEZONE': 'Europe/Berlin',
+            'EXTENDED_SITEMAP_PLUGIN': {
+                'changes': True,
+            },
+        }
+        path_changes = os.path.join(self.path_temp, 'sitemap-changes.json')
+
+        def read_changes():
+            with open(path_changes) as fd:
+                return json.load(fd)
+
+        self.__execute_pelican(settings_override=settings_override)
+        changes = read_changes()
+        with open(os.path.join(self.path_temp, 'sitemap.xml')) as fd:
+            self.assertEqual(changes['added'], re.findall(r'<loc>(.*?)</loc>', fd.read()))
+        self.assertTrue(changes['initial'])
+
+        # the translations add two urls
+        settings_override['EXTENDED_SITEMAP_PLUGIN']['translations'] = True
+        self.__execute_pelican(settings_override=settings_override)
+        translations = ['http://example.com/article-two-de.html', 'http://example.com/pages/page-one-de.html']
+        self.assertEqual(
+            read_changes(),
+            {'initial': False, 'added': translations, 'updated': [], 'removed': []}
+        )
+
+        settings_override['EXTENDED_SITEMAP_PLUGIN']['translations'] = False
+        self.__execute_pelican(settings_override=settings_override)
+        self.assertEqual(
+            read_changes(),
+            {'initial': False, 'added': [], 'updated': [], 'removed': translations}
+        )
+
+    def test_sitemap_rules(self):
+        """
+        Tests the priority, change frequency and exclusion rules.
+        """
+        self.__execute_pelican(
+            settings_override={
+                'TIMEZONE': 'Europe/Berlin',
+                'EXTENDED_SITEMAP_PLUGIN': {
+                    'rules': [
+                        {'pattern': 'tag/*', 'exclude': True},
+                        {'regex': r'pages/page-(one|two)\.html$', 'priority': 0.7, 'changefreq': 'weekly'},
+                        {'category': 'Sample Category 2', 'priority': 0.9},
+                        {'pattern': 'article-*.html', 'changefreq': 'daily'},
+                    ],
+                },
+            }
+        )
+        self.assertFileContentEquals(
+            os.path.join(EXPECTED_DIR, 'test_sitemap_rules.xml'),
+            os.path.join(self.path_temp, 'sitemap.xml')
+        )
+
+    def test_sitemap_lastmod_git(self):
+        """
+        Tests the lastmod values from the git history of the content files, cached by the HEAD commit.
+        """
+        path_content = os.path.join(mkdtemp(prefix='extended_sitemap_content.'), 'content')
+        shutil.copytree(CONTENT_DIR, path_content)
+
+        def git(date, *args):
+            env = dict(os.environ, GIT_AUTHOR_DATE=date, GIT_COMMITTER_DATE=date)
+            subprocess.check_call(
+                ['git', '-c', 'user.name=Test', '-c', 'user.email=test@example.com'] + list(args),
+                cwd=path_content,
+                env=env,
+                stdout=subprocess.PIPE
+            )
+
+        git('2015-03-01T12:00:00+0000', 'init', '-q')
+        git('2015-03-01T12:00:00+0000', 'add', '.')
+        git('2015-03-01T12:00:00+0000', 'commit', '-q', '-m', 'content')
+        with open(os.path.join(path_content, 'pages', 'page3.md'), 'a') as fd:
+            fd.write('\nChanged.\n')
+        git('2016-04-01T12:00:00+0000', 'commit', '-q', '-a', '-m', 'change')
+
+        self.__execute_pelican(
+            settings_override={
+                'TIMEZONE': 'Europe/Berlin',
+                'PATH': path_content,
+                'PAGE_DIR': os.path.join(path_content, 'pages'),
+                'ARTICLE_DIR': os.path.join(path_content, 'articles'),
+                'EXTENDED_SITEMAP_PLUGIN': {
+                    'lastmod_source': 'git',
+                },
+            }
+        )
+        shutil.rmtree(os.path.dirname(path_content))
+
+        with open(os.path.join(self.path_temp, 'sitemap.xml')) as fd:
+            lastmods = dict(re.findall(r'<loc>(.*?)</loc>\n(?:<lastmod>(.*?)</lastmod>)?', fd.read()))
+        # the modified metadata wins over the git history
+        self.assertEqual(lastmods['http://example.com/article-three.html'], '2014-06-01')
+        # the git history wins over the date metadata
+        self.assertEqual(lastmods['http://example.com/article-one.html'], '2015-03-01')
+        self.assertEqual(lastmods['http://example.com/pages/page-three.html'], '2016-04-01')
+        self.assertEqual(lastmods['http://example.com/pages/page-four.html'], '2015-03-01')
+        self.assertEqual(lastmods['http://example.com/'], '2015-03-01')
+        self.assertEqual(lastmods['http://example.com/category/sample-category-1.html'], '2015-03-01')
+        self.assertTrue(os.path.exists(os.path.join(self.path_cache, 'extended_sitemap_git.cache')))
+
+    def test_sitemap_pagination(self):
+        """
+        Tests the urls of the paginated listings, every page is modified with the newest article on it or before it.
+        """
+        self.__execute_pelican(
+            settings_override={
+                'TIMEZONE': 'Europe/Berlin',
+                'DEFAULT_PAGINATION': 1,
+                'ARTICLE_ORDER_BY': 'title',
+                'PAGINATION_PATTERNS': [
+                    (1, '{url}', '{save_as}'),
+                    (2, '{base_name}/page/{number}/', '{base_name}/page/{number}/index.html'),
+                ],
+            }
+        )
+        self.assertFileContentEquals(
+            os.path.join(EXPECTED_DIR, 'test_sitemap_pagination.xml'),
+            os.path.join(self.path_temp, 'sitemap.xml')
+        )
+
+    def test_sitemap_pagination_rules(self):
+        """
+        Tests that paginated listing pages can be excluded by rules.
+        """
+        self.__execute_pelican(
+            settings_override={
+                'TIMEZONE': 'Europe/Berlin',
+                'DEFAULT_PAGINATION': 1,
+                'ARTICLE_ORDER_BY': 'title',
+                'EXTENDED_SITEMAP_PLUGIN': {
+                    'rules': [
+                        {'pattern': 'index?*.html', 'exclude': True},
+                        {'pattern': 'tag/tag1?*.html', 'exclude': True},
+                    ],
+                },
+            }
+        )
+        with open(os.path.join(self.path_temp, 'sitemap.xml')) as fd:
+            locs = re.findall(r'<loc>(.*?)</loc>', fd.read())
+        self.assertEqual([loc for loc in locs if 'index' in loc], [])
+        self.assertIn('http://example.com/', locs)
+        self.assertIn('http://example.com/tag/tag1.html', locs)
+        self.assertNotIn('http://example.com/tag/tag12.html', locs)
+        self.assertIn('http://example.com/article-one.html', locs)
+
+    def test_sitemap_incremental(self):
+        """
+        Tests that in incremental mode the output files are not touched if nothing changed and regenerated otherwise.
+        """
+        settings_override = {
+            'TIMEZONE': 'Europe/Berlin',
+            'EXTENDED_SITEMAP_PLUGIN': {
+                'incremental': True,
+            },
+        }
+        self.__execute_pelican(settings_override=settings_override)
+        self.assertTrue(os.path.exists(os.path.join(self.path_cache, 'extended_sitemap.cache')))
+        path_sitemap = os.path.join(self.path_temp, 'sitemap.xml')
+        path_stylesheet = os.path.join(self.path_temp, 'sitemap-stylesheet.xsl')
+        os.utime(path_sitemap, (0, 0))
+        os.utime(path_stylesheet, (0, 0))
+
+        # nothing changed
+        self.__execute_pelican(settings_override=settings_override)
+        self.assertEqual(os.path.getmtime(path_sitemap), 0)
+        self.assertEqual(os.path.getmtime(path_stylesheet), 0)
+
+        # changed category urls
+        settings_override['CATEGORY_REGEX_SUBSTITUTIONS'] = [
+            (r'[^\w\s-]', ''), (r'(?u)\A\s*', ''), (r'(?u)\s*\Z', ''), (r'[-\s]+', '_'),
+        ]
+        self.__execute_pelican(settings_override=settings_override)
+        with open(path_sitemap) as fd:
+            self.assertIn('<loc>http://example.com/category/sample_category_1.html</loc>', fd.read())
+        del settings_override['CATEGORY_REGEX_SUBSTITUTIONS']
+
+        # changed site url
+        settings_override['SITEURL'] = 'http://example.com/subpath'
+        self.__execute_pelican(settings_override=settings_override)
+        self.assertNotEqual(os.path.getmtime(path_sitemap), 0)
+        self.assertFileContentEquals(
+            os.path.join(EXPECTED_DIR, 'test_sitemap_structure_subpath.xml'),
+            path_sitemap
+        )
+
+    def test_sitemap_incremental_fingerprint(self):
+        """
+        Tests that the fingerprint changes with the settings the urls of the paginated listings are built from.
+        """
+        generator = create_generator(create_context(100), self.path_temp, {'incremental': True})
+        get_fingerprint = generator._SitemapGenerator__get_fingerprint
+        fingerprints = set([get_fingerprint()])
+        for key, value in (
+            ('INDEX_URL', 'blog/'),
+            ('CATEGORY_SAVE_AS', 'category/{slug}/index.html'),
+            ('TAG_SAVE_AS', 'tag/{slug}/index.html'),
+            ('AUTHOR_SAVE_AS', 'author/{slug}/index.html'),
+            ('ARCHIVES_SAVE_AS', 'archives/index.html'),
+            ('ARCHIVES_URL', 'archives/'),
+        ):
+            generator.pelican_settings[key] = value
+            fingerprints.add(get_fingerprint())
+        self.assertEqual(len(fingerprints), 7)
+
+    def test_sitemap_gzip(self):
+        """
+        Tests the gzip compressed sitemap output with deterministic gzip headers.
+        """
+        self.__execute_pelican(
+            settings_override={
+                'TIMEZONE': 'Europe/Berlin',
+                'EXTENDED_SITEMAP_PLUGIN': {
+                    'gzip': True,
+                },
+            }
+        )
+        path_gzip = os.path.join(self.path_temp, 'sitemap.xml.gz')
+        self.assertFalse(os.path.exists(os.path.join(self.path_temp, 'sitemap.xml')))
+        with open(path_gzip, 'rb') as fd:
+            # the mtime field of the gzip header
+            self.assertEqual(fd.read(8)[4:], b'\x00\x00\x00\x00')
+        path_plain = os.path.join(self.path_temp, 'sitemap-uncompressed.xml')
+        with gzip.open(path_gzip, 'rb') as fd_in:
+            with open(path_plain, 'wb') as fd_out:
+                fd_out.write(fd_in.read())
+        self.assertFileContentEquals(
+            os.path.join(EXPECTED_DIR, 'test_sitemap_structure.xml'),
+            path_plain
+        )
+
+    def test_sitemap_gzip_keep_plain(self):
+        """
+        Tests that the plain sitemap is written along with the compressed one if configured.
+        """
+        self.__execute_pelican(
+            settings_override={
+                'TIMEZONE': 'Europe/Berlin',
+                'EXTENDED_SITEMAP_PLUGIN': {
+                    'gzip': True,
+                    'gzip_keep_plain': True,
+                },
+            }
+        )
+        self.assertTrue(os.path.exists(os.path.join(self.path_temp, 'sitemap.xml.gz')))
+        self.assertFileContentEquals(
+            os.path.join(EXPECTED_DIR, 'test_sitemap_structure.xml'),
+            os.path.join(self.path_temp, 'sitemap.xml')
+        )
+
+    def test_sitemap_statistics(self):
+        """
+        Tests the statistics file with the timings of the generation phases and the number of url nodes.
+        """
+        self.__execute_pelican(
+            settings_override={
+                'TIMEZONE': 'Europe/Berlin',
+                'EXTENDED_SITEMAP_PLUGIN': {
+                    'statistics': True,
+                    'statistics_file': 'sitemap-statistics.json',
+                },
+            }
+        )
+        with open(os.path.join(self.path_temp, 'sitemap-statistics.json')) as fd:
+            statistics = json.load(fd)
+        for phase in ('stylesheet', 'sort_articles', 'sort_pages', 'index', 'articles', 'pages', 'categories', 'tags',
+                      'authors', 'direct_templates', 'write'):
+            self.assertIn(phase, statistics['timings'])
+        self.assertEqual(
+            statistics['nodes'],
+            {'index': 1, 'articles': 3, 'pages': 4, 'categories': 3, 'tags': 5, 'authors': 3, 'direct_templates': 4}
+        )
+        self.assertEqual(statistics['total_nodes'], 23)
+        self.assertEqual(
+            statistics['bytes_written'],
+            os.path.getsize(os.path.join(self.path_temp, 'sitemap.xml')) +
+            os.path.getsize(os.path.join(self.path_temp, 'sitemap-stylesheet.xsl'))
+        )
+
+    def __write_settings_file(self, settings):
+        """
+        Writes the given settings merged into self.settings_default as pelican settings file.
+        :param settings: dictionary with pelican setting values to set
+        :type settings: dict
+        :returns: the path of the settings file
+        :rtype: str
+        """
+        settings_file = self.settings_default.copy()
+        settings_file.update(settings)
+        path = os.path.join(self.path_cache, 'pelicanconf.py')
+        with open(path, 'w') as fd:
+            for key, value in settings_file.items():
+                fd.write('{} = {!r}\n'.format(key, value))
+        return path
+
+    def test_cli_snapshot(self):
+        """
+        Tests that the command line rebuilds the same sitemap from the snapshot and applies changed settings.
+        """
+        settings_override = {
+            'TIMEZONE': 'Europe/Berlin',
+            'EXTENDED_SITEMAP_PLUGIN': {
+                'snapshot': True,
+            },
+        }
+        self.__execute_pelican(settings_override=settings_override)
+        path_settings = self.__write_settings_file(settings_override)
+        path_sitemap = os.path.join(self.path_temp, 'sitemap.xml')
+        os.remove(path_sitemap)
+
+        self.assertEqual(cli_main(['-s', path_settings]), 0)
+        self.assertFileContentEquals(os.path.join(EXPECTED_DIR, 'test_sitemap_structure.xml'), path_sitemap)
+
+        self.assertEqual(cli_main(['-s', path_settings, '--plugin-settings', json.dumps({
+            'priorities': {'index': 1.0, 'articles': 0.3, 'pages': 0.5, 'others': 0.4},
+        })]), 0)
+        with open(path_sitemap) as fd:
+            self.assertIn(
+                '<loc>http://example.com/article-one.html</loc>\n<lastmod>2007-11-19</lastmod>\n'
+                '<changefreq>weekly</changefreq>\n<priority>0.30</priority>',
+                fd.read()
+            )
+
+    def test_cli_scan(self):
+        """
+        Tests that the command line builds the sitemap from the html files of the output dir without a snapshot.
+        """
+        settings_override = {'TIMEZONE': 'Europe/Berlin'}
+        self.__execute_pelican(settings_override=settings_override)
+        path_settings = self.__write_settings_file(settings_override)
+        self.assertEqual(cli_main(['-s', path_settings]), 1)
+        for path in ('drafts/secret.html', 'theme/preview.html'):
+            if not os.path.isdir(os.path.join(self.path_temp, os.path.dirname(path))):
+                os.makedirs(os.path.join(self.path_temp, os.path.dirname(path)))
+            with open(os.path.join(self.path_temp, path), 'w') as fd:
+                fd.write('<html></html>')
+        self.assertEqual(cli_main(['-s', path_settings, '--source', 'scan']), 0)
+        with open(os.path.join(self.path_temp, 'sitemap.xml')) as fd:
+            locs = re.findall(r'<loc>(.*?)</loc>', fd.read())
+        self.assertEqual(locs[0], 'http://example.com/')
+        self.assertFalse([loc for loc in locs if '/drafts/' in loc or '/theme/' in loc])
+        self.assertIn('http://example.com/pages/page-one.html', locs)
+        self.assertIn('http://example.com/category/sample-category-1.html', locs)
+
+    def test_sitemap_lastmod_datetime(self):
+        """
+        Tests the lastmod values with datetime precision.
+        """
+        self.__execute_pelican(
+            settings_override={
+                'TIMEZONE': 'Europe/Berlin',
+                'EXTENDED_SITEMAP_PLUGIN': {
+                    'lastmod_precision': 'datetime',
+                },
+            }
+        )
+        with open(os.path.join(self.path_temp, 'sitemap.xml')) as fd:
+            lastmods = dict(re.findall(r'<loc>(.*?)</loc>\n(?:<lastmod>(.*?)</lastmod>)?', fd.read()))
+        self.assertEqual(lastmods['http://example.com/article-one.html'], '2007-11-19T21:16:00+01:00')
+        self.assertEqual(lastmods['http://example.com/category/sample-category-1.html'], '2007-11-19T21:16:00+01:00')
+
+    def test_sitemap_translations(self):
+        """
+        Tests that translations are included with hreflang alternates for every translation group.
+        """
+        self.__execute_pelican(
+            settings_override={
+                'TIMEZONE': 'Europe/Berlin',
+                'EXTENDED_SITEMAP_PLUGIN': {
+                    'translations': True,
+                },
+            }
+        )
+        self.assertFileContentEquals(
+            os.path.join(EXPECTED_DIR, 'test_sitemap_translations.xml'),
+            os.path.join(self.path_temp, 'sitemap.xml')
+        )
+
+    def test_sitemap_media(self):
+        """
+        Tests the image and video nodes extracted from the content and the cache of the extracted media.
+        """
+        self.__execute_pelican(
+            settings_override={
+                'TIMEZONE': 'Europe/Berlin',
+                'EXTENDED_SITEMAP_PLUGIN': {
+                    'images': True,
+                    'videos': True,
+                },
+            }
+        )
+        self.assertFileContentEquals(
+            os.path.join(EXPECTED_DIR, 'test_sitemap_media.xml'),
+            os.path.join(self.path_temp, 'sitemap.xml')
+        )
+        self.assertTrue(os.path.exists(os.path.join(self.path_cache, 'extended_sitemap_media.cache')))
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for the SitemapGenerator with synthetic content.
+
+The content is created as lightweight fake objects and passed directly to the generator, the reader pipeline of
+Pelican is not involved. For every size the wall time, the peak memory and the output size of the generation phases
+are measured and written as JSON, so the results of different versions can be compared.
+
+Usage::
+
+    python -m extended_sitemap.tests.benchmark --sizes 1000 10000 --output benchmark.json
+"""
+from __future__ import unicode_literals, print_function
+
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import time
+
+from datetime import datetime, timedelta
+from itertools import chain
+from tempfile import mkdtemp
+
+from pytz import timezone
+
+from extended_sitemap import SitemapGenerator
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2 has no tracemalloc, the peak memory is not measured then
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    # Windows has no resource module, the peak RSS is not measured then
+    resource = None
+
+
+SIZES = [1000, 10000, 100000, 1000000]
+TIMEZONE = 'Europe/Berlin'
+
+
+class FakeUrlWrapper(object):
+    """
+    Stand-in for pelican.urlwrappers.Category, pelican.urlwrappers.Tag and pelican.urlwrappers.Author.
+    """
+    __slots__ = ('name', 'url')
+
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+
+    def __str__(self):
+        return self.name
+
+
+class FakeContent(object):
+    """
+    Stand-in for pelican.contents.Article and pelican.contents.Page.
+    """
+    __slots__ = ('title', 'url', 'date', 'modified', 'category', 'tags', 'authors', 'metadata')
+
+    def __init__(self, title, url, date=None, modified=None, category=None, tags=None, authors=None, metadata=None):
+        self.title = title
+        self.url = url
+        self.date = date
+        self.modified = modified
+        self.category = category
+        self.tags = tags
+        self.authors = authors
+        self.metadata = metadata
+
+
+def create_context(size):
+    """
+    Creates a synthetic pelican context with the given number of articles and pages.
+    90% of the items are articles, 10% are pages of which every tenth has no date.
+    :param size: the total number of articles and pages
+    :type size: int
+    :returns: the context
+    :rtype: dict
+    """
+    tz = timezone(TIMEZONE)
+    start = tz.localize(datetime(2010, 1, 1, 12, 0))
+    count_articles = size * 9 // 10
+    count_pages = size - count_articles
+
+    categories = [FakeUrlWrapper('category{}'.format(i), 'category/category{}.html'.format(i)) for i in range(max(1, size // 1000))]
+    tags = [FakeUrlWrapper('tag{}'.format(i), 'tag/tag{}.html'.format(i)) for i in range(max(1, size // 100))]
+    authors = [FakeUrlWrapper('author{}'.format(i), 'author/author{}.html'.format(i)) for i in range(max(1, size // 5000))]
+    articles_by_category = dict((category, []) for category in categories)
+    articles_by_tag = dict((tag, []) for tag in tags)
+    articles_by_author = dict((author, []) for author in authors)
+
+    articles = []
+    for i in range(count_articles):
+        # spread the dates in a non-monotonic way, so sorting has to do some work
+        date = start + timedelta(hours=(i * 7919) % (count_articles * 2))
+        article = FakeContent(
+            'Article {}'.format(i),
+            'article-{}.html'.format(i),
+            date=date,
+            modified=date + timedelta(days=3) if i % 4 == 0 else None,
+            category=categories[i % len(categories)],
+            tags=[tags[(i + offset) % len(tags)] for offset in range(3)],
+            authors=[authors[i % len(authors)]],
+        )
+        articles.append(article)
+        articles_by_category[article.category].append(article)
+        for tag in article.tags:
+            articles_by_tag[tag].append(article)
+        for author in article.authors:
+            articles_by_author[author].append(article)
+
+    pages = []
+    for i in range(count_pages):
+        date = None if i % 10 == 0 else start + timedelta(hours=(i * 104729) % (count_pages * 2))
+        pages.append(FakeContent('Page {}'.format(i), 'pages/page-{}.html'.format(i), date=date))
+
+    return {
+        'SITENAME': 'Benchmark',
+        'ARTICLE_URL': '{slug}.html',
+        'CATEGORY_URL': 'category/{slug}.html',
+        'TAG_URL': 'tag/{slug}.html',
+        'AUTHOR_URL': 'author/{slug}.html',
+        'DIRECT_TEMPLATES': ['index', 'tags', 'categories', 'authors', 'archives'],
+        'articles': articles,
+        'pages': pages,
+        'categories': [(category, articles_by_category[category]) for category in categories],
+        'tags': [(tag, articles_by_tag[tag]) for tag in tags],
+        'authors': [(author, articles_by_author[author]) for author in authors],
+    }
+
+
+def create_generator(context, path_output, plugin_settings=None):
+    """
+    Creates the SitemapGenerator for the given context.
+    :param context: the synthetic context
+    :type context: dict
+    :param path_output: the output dir
+    :type path_output: str
+    :param plugin_settings: the EXTENDED_SITEMAP_PLUGIN settings
+    :type plugin_settings: dict | None
+    :rtype: SitemapGenerator
+    """
+    settings = {
+        'TIMEZONE': TIMEZONE,
+        'SITEURL': 'http://example.com',
+        'CACHE_PATH': os.path.join(path_output, 'cache'),
+    }
+    if plugin_settings is not None:
+        settings['EXTENDED_SITEMAP_PLUGIN'] = plugin_settings
+    return SitemapGenerator(context, settings, None, None, path_output)
+
+
+def consume(nodes):
+    """
+    Consumes the given url nodes and returns their total size in bytes.
+    :param nodes: iterable of (url node text, lastmod) tuples
+    :type nodes: collections.Iterable
+    :rtype: int
+    """
+    return sum(len(node.encode('utf-8')) for node, lastmod in nodes)
+
+
+def get_output_size(path_output):
+    """
+    Returns the total size of the sitemap files in the given output dir.
+    :param path_output: the output dir
+    :type path_output: str
+    :rtype: int
+    """
+    return sum(
+        os.path.getsize(os.path.join(path_output, filename))
+        for filename in os.listdir(path_output)
+        if filename.startswith('sitemap') and not filename.endswith('.xsl')
+    )
+
+
+def get_phases(context, path_output, plugin_settings):
+    """
+    Returns the phases to measure as (name, callable) tuples, every callable returns the output size in bytes.
+    :param context: the synthetic context
+    :type context: dict
+    :param path_output: the output dir
+    :type path_output: str
+    :param plugin_settings: the EXTENDED_SITEMAP_PLUGIN settings
+    :type plugin_settings: dict | None
+    :rtype: list
+    """
+    generator = create_generator(context, path_output, plugin_settings)
+    sorted_content = generator._SitemapGenerator__get_sorted_content()
+
+    def sorting():
+        generator._SitemapGenerator__get_sorted_content()
+        return 0
+
+    def rendering():
+        articles_sorted, pages_sorted = sorted_content
+        return consume(generator._SitemapGenerator__render_entries(chain(
+            generator._SitemapGenerator__generate_index_entries(articles_sorted, pages_sorted),
+            generator._SitemapGenerator__generate_content_entries(articles_sorted, 'articles'),
+            generator._SitemapGenerator__generate_content_entries(pages_sorted, 'pages'),
+        )))
+
+    def taxonomies():
+        return consume(generator._SitemapGenerator__render_entries(
+            generator._SitemapGenerator__generate_taxonomy_entries(sorted_content[0])
+        ))
+
+    def writing():
+        # the complete generation including the file output
+        create_generator(context, path_output, plugin_settings).generate_output(None)
+        return get_output_size(path_output)
+
+    return [
+        ('sorting', sorting),
+        ('rendering', rendering),
+        ('taxonomies', taxonomies),
+        ('writing', writing),
+    ]
+
+
+def measure(func):
+    """
+    Measures the wall time and the peak memory of the given callable.
+    The wall time is measured in a separate run without memory tracing, as tracing slows down the execution.
+    :param func: the callable to measure, returning the output size
+    :type func: callable
+    :returns: dict with the measured values
+    :rtype: dict
+    """
+    gc.collect()
+    time_start = time.time()
+    output_size = func()
+    wall_time = time.time() - time_start
+
+    peak_memory = None
+    if tracemalloc is not None:
+        gc.collect()
+        tracemalloc.start()
+        func()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {
+        'wall_time': round(wall_time, 6),
+        'peak_memory': peak_memory,
+        'output_size': output_size,
+    }
+
+
+def get_max_rss():
+    """
+    Returns the peak resident set size of the process so far in bytes.
+    :rtype: int | None
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def run(sizes, plugin_settings=None):
+    """
+    Runs the benchmark for the given sizes.
+    :param sizes: the numbers of content items
+    :type sizes: list
+    :param plugin_settings: the EXTENDED_SITEMAP_PLUGIN settings
+    :type plugin_settings: dict | None
+    :returns: the results
+    :rtype: dict
+    """
+    results = []
+    for size in sizes:
+        context = create_context(size)
+        path_output = mkdtemp(prefix='extended_sitemap_benchmark.')
+        try:
+            phases = {}
+            for name, func in get_phases(context, path_output, plugin_settings):
+                phases[name] = measure(func)
+                print('{:>8} items, {:<11} {:>9.3f}s'.format(size, name, phases[name]['wall_time']), file=sys.stderr)
+        finally:
+            shutil.rmtree(path_output)
+        results.append({
+            'size': size,
+            'articles': len(context['articles']),
+            'pages': len(context['pages']),
+            'phases': phases,
+            'max_rss': get_max_rss(),
+        })
+    return {
+        'python': platform.python_version(),
+        'settings': plugin_settings,
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the extended_sitemap SitemapGenerator with synthetic content.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='numbers of content items to benchmark')
+    parser.add_argument('--settings', type=json.loads, default=None, help='EXTENDED_SITEMAP_PLUGIN settings as JSON')
+    parser.add_argument('--output', default=None, help='file to write the JSON results to, defaults to stdout')
+    args = parser.parse_args(argv)
+
+    results = json.dumps(run(args.sizes, args.settings), indent=2, sort_keys=True)
+    if args.output is None:
+        print(results)
+    else:
+        with open(args.output, 'w') as fd:
+            fd.write(results)
+
+
+if __name__ == '__main__':
+    main()